@@ -0,0 +1,347 @@
+#!/usr/bin/env python3
+"""
+Offline Benchmark Script
+Replay a video file or a directory of frames through the detection pipeline
+(resize + YOLO, face recognition, zoom, persistence) as fast as possible and
+print the results as JSON.
+
+No RTSP, Telegram or network is used; detections are written to a temporary
+database and uploads directory. Settings are read from the environment like
+main.py, so configs can be compared with e.g.:
+
+    FRAME_RESIZE_WIDTH=320 python3 benchmark.py recording.mp4 --output small.json
+
+With --compare-backends the person detector alone is run on every backend
+listed and checked for parity against the ultralytics/PyTorch path:
+
+    python3 benchmark.py recording.mp4 --frames 200 --compare-backends onnxruntime,openvino
+"""
+
+import argparse
+import contextlib
+import json
+import os
+import resource
+import subprocess
+import sys
+import tempfile
+import time
+from pathlib import Path
+
+# Must be set before main.py reads its configuration
+os.environ['TELEGRAM_BOT_TOKEN'] = ''
+
+import numpy as np
+
+import main
+
+
+class StageTimer:
+    """Collect per-call latencies for named pipeline stages"""
+
+    def __init__(self):
+        self.samples = {}
+
+    def record(self, stage, seconds):
+        self.samples.setdefault(stage, []).append(seconds * 1000)
+
+    def wrap(self, stage, func):
+        """Return func timed under stage"""
+        def timed(*args, **kwargs):
+            start_time = time.perf_counter()
+            try:
+                return func(*args, **kwargs)
+            finally:
+                self.record(stage, time.perf_counter() - start_time)
+        return timed
+
+    def summary(self):
+        result = {}
+        for stage, values in self.samples.items():
+            values = np.array(values)
+            result[stage] = {
+                'count': len(values),
+                'mean_ms': round(float(values.mean()), 3),
+                'p50_ms': round(float(np.percentile(values, 50)), 3),
+                'p95_ms': round(float(np.percentile(values, 95)), 3),
+                'p99_ms': round(float(np.percentile(values, 99)), 3),
+            }
+        return result
+
+
+def read_frames(source_url, loop=False):
+    """Yield BGR frames from a video file, image directory or synthetic:// source, unpaced"""
+    source = main.open_frame_source(source_url)
+    source.loop = loop
+    if not source.open():
+        raise ValueError(f"Cannot open {source_url}")
+    # Replay as fast as the pipeline takes frames
+    source.fps = 0
+
+    try:
+        while True:
+            ret, frame = source.read()
+            if not ret:
+                return
+            yield frame
+    finally:
+        source.release()
+
+
+def git_commit():
+    try:
+        return subprocess.run(['git', 'rev-parse', '--short', 'HEAD'], capture_output=True, text=True,
+                              cwd=Path(__file__).parent, check=True).stdout.strip()
+    except (OSError, subprocess.CalledProcessError):
+        return None
+
+
+def instrument(timer):
+    """Time the real pipeline functions; handle_frame looks them up at call time"""
+    main.recognize_persons = timer.wrap('face_recognition', main.recognize_persons)
+    main.zoom_frame = timer.wrap('zoom', main.zoom_frame)
+    main.save_detection = timer.wrap('persist_submit', main.save_detection)
+    main.write_jpeg = timer.wrap('jpeg_write', main.write_jpeg)
+    main.write_thumbnail = timer.wrap('thumbnail_write', main.write_thumbnail)
+
+
+def run_benchmark(args):
+    work_dir = Path(tempfile.mkdtemp(prefix='riftech-bench-'))
+    main.DATABASE_PATH = str(work_dir / 'detections.db')
+    main.UPLOADS_DIR = work_dir / 'uploads'
+    main.THUMBNAILS_DIR = main.UPLOADS_DIR / 'thumbs'
+    main.THUMBNAILS_DIR.mkdir(parents=True)
+    main.init_database()
+
+    main.models.load()
+    if main.models.state != 'ready':
+        raise RuntimeError(f"Models failed to load: {main.models.error}")
+
+    timer = StageTimer()
+    instrument(timer)
+    camera = main.CameraStream({'id': 'bench', 'name': 'Benchmark', 'url': args.source})
+    batch_size = args.batch_size or main.YOLO_BATCH_SIZE
+
+    decoded = processed = skipped = 0
+    batch = []
+
+    def run_batch():
+        start_time = time.perf_counter()
+        results = main.detect_persons_batch(batch)
+        per_frame = (time.perf_counter() - start_time) / len(batch)
+        for frame, detections in zip(batch, results):
+            # Includes the resize to FRAME_RESIZE_WIDTH
+            timer.record('yolo', per_frame)
+            frame_start = time.perf_counter()
+            main.handle_frame(camera, frame, detections)
+            timer.record('frame_total', per_frame + time.perf_counter() - frame_start)
+        batch.clear()
+
+    cpu_start = os.times()
+    wall_start = time.perf_counter()
+
+    frames = read_frames(args.source, loop=args.loop)
+    while args.frames <= 0 or decoded < args.frames:
+        read_start = time.perf_counter()
+        frame = next(frames, None)
+        if frame is None:
+            break
+        timer.record('decode', time.perf_counter() - read_start)
+        decoded += 1
+
+        # Fixed sampling; the live loop adapts its rate instead
+        if decoded % args.interval:
+            continue
+        if args.motion and not camera.should_process(frame):
+            skipped += 1
+            continue
+
+        batch.append(frame)
+        processed += 1
+        if len(batch) >= batch_size:
+            run_batch()
+
+    if batch:
+        run_batch()
+
+    # Include the time to get every queued detection on disk
+    flush_start = time.perf_counter()
+    main.detection_writer.stop()
+    flush_seconds = time.perf_counter() - flush_start
+
+    wall_seconds = time.perf_counter() - wall_start
+    cpu_end = os.times()
+    cpu_seconds = (cpu_end.user - cpu_start.user) + (cpu_end.system - cpu_start.system)
+
+    conn = main.get_db_connection()
+    detections_saved = conn.execute('SELECT COUNT(*) FROM detections').fetchone()[0]
+    conn.close()
+
+    return {
+        'source': args.source,
+        'commit': git_commit(),
+        'config': {
+            'DETECTOR_BACKEND': main.DETECTOR_BACKEND,
+            'FRAME_RESIZE_WIDTH': main.FRAME_RESIZE_WIDTH,
+            'interval': args.interval,
+            'YOLO_BATCH_SIZE': batch_size,
+            'CONFIDENCE_THRESHOLD': main.CONFIDENCE_THRESHOLD,
+            'FACE_REGION_WIDTH': main.FACE_REGION_WIDTH,
+            'motion_gating': args.motion,
+        },
+        'model_load_seconds': main.models.status()['timings'],
+        'frames': {'decoded': decoded, 'processed': processed, 'skipped_by_motion': skipped},
+        'wall_seconds': round(wall_seconds, 3),
+        'fps': {
+            'decoded': round(decoded / wall_seconds, 2) if wall_seconds else 0.0,
+            'processed': round(processed / wall_seconds, 2) if wall_seconds else 0.0,
+        },
+        'stages': timer.summary(),
+        'persistence': {
+            'detections_saved': detections_saved,
+            'flush_seconds': round(flush_seconds, 3),
+            'commit_latency_ms': main.detection_writer.commit_latency.snapshot(),
+        },
+        # ru_maxrss is in KiB on Linux
+        'peak_rss_mb': round(resource.getrusage(resource.RUSAGE_SELF).ru_maxrss / 1024, 1),
+        'cpu': {
+            'seconds': round(cpu_seconds, 3),
+            'cores_used': round(cpu_seconds / wall_seconds, 3) if wall_seconds else 0.0,
+            'utilization_pct': round(100 * cpu_seconds / wall_seconds / (os.cpu_count() or 1), 1)
+                               if wall_seconds else 0.0,
+        },
+        'work_dir': str(work_dir),
+    }
+
+
+def time_detector(detector, frames, batch_size):
+    """Run detector over frames in batches; returns (detections, per-frame latencies in seconds)"""
+    # Warm-up call so one-time allocations are not measured
+    detector.detect(frames[:batch_size])
+
+    detections = []
+    latencies = []
+    for start in range(0, len(frames), batch_size):
+        batch = frames[start:start + batch_size]
+        start_time = time.perf_counter()
+        detections.extend(detector.detect(batch))
+        latencies.extend([(time.perf_counter() - start_time) / len(batch)] * len(batch))
+    return detections, latencies
+
+
+def compare_detections(reference, candidate, iou_threshold=0.5):
+    """Greedy IoU matching of candidate boxes against the reference, frame by frame"""
+    matched = reference_total = candidate_total = 0
+    ious = []
+    confidence_deltas = []
+
+    for reference_boxes, candidate_boxes in zip(reference, candidate):
+        reference_total += len(reference_boxes)
+        candidate_total += len(candidate_boxes)
+        unused = list(candidate_boxes)
+
+        for box in reference_boxes:
+            scored = [(main.bbox_iou(box[:4], other[:4]), other) for other in unused]
+            if not scored:
+                break
+            iou, best = max(scored, key=lambda item: item[0])
+            if iou >= iou_threshold:
+                unused.remove(best)
+                matched += 1
+                ious.append(iou)
+                confidence_deltas.append(abs(box[4] - best[4]))
+
+    return {
+        'reference_boxes': reference_total,
+        'candidate_boxes': candidate_total,
+        'recall': round(matched / reference_total, 4) if reference_total else 1.0,
+        'precision': round(matched / candidate_total, 4) if candidate_total else 1.0,
+        'mean_iou': round(float(np.mean(ious)), 4) if ious else None,
+        'max_confidence_delta': round(float(max(confidence_deltas)), 4) if confidence_deltas else None,
+    }
+
+
+def compare_backends(args):
+    """Detector-only speed and parity of each backend against ultralytics"""
+    frame_limit = args.frames or 100
+    frames = []
+    for frame in read_frames(args.source, loop=args.loop):
+        frames.append(main.resize_for_detection(frame)[0])
+        if len(frames) >= frame_limit:
+            break
+    batch_size = args.batch_size or main.YOLO_BATCH_SIZE
+
+    def latency_summary(latencies):
+        values = np.array(latencies) * 1000
+        return {
+            'mean_ms': round(float(values.mean()), 3),
+            'p50_ms': round(float(np.percentile(values, 50)), 3),
+            'p95_ms': round(float(np.percentile(values, 95)), 3),
+            'fps': round(1000 / float(values.mean()), 2),
+        }
+
+    reference_detections, reference_latencies = time_detector(main.UltralyticsDetector(), frames, batch_size)
+    reference = latency_summary(reference_latencies)
+    report = {
+        'source': args.source,
+        'commit': git_commit(),
+        'frames': len(frames),
+        'config': {
+            'FRAME_RESIZE_WIDTH': main.FRAME_RESIZE_WIDTH,
+            'DETECTOR_INPUT_SIZE': main.DETECTOR_INPUT_SIZE,
+            'DETECTOR_THREADS': main.DETECTOR_THREADS,
+            'CONFIDENCE_THRESHOLD': main.CONFIDENCE_THRESHOLD,
+            'int8': args.int8,
+            'batch_size': batch_size,
+        },
+        'reference': dict(reference, backend='ultralytics'),
+        'backends': {},
+        'passed': True,
+    }
+
+    for backend in args.compare_backends.split(','):
+        detector = main.create_detector(backend, int8=args.int8)
+        detections, latencies = time_detector(detector, frames, batch_size)
+        summary = latency_summary(latencies)
+        parity = compare_detections(reference_detections, detections)
+        passed = parity['recall'] >= args.min_parity and parity['precision'] >= args.min_parity
+        report['backends'][backend] = dict(summary, speedup=round(reference['mean_ms'] / summary['mean_ms'], 2),
+                                           parity=parity, passed=passed)
+        report['passed'] = report['passed'] and passed
+
+    return report
+
+
+def parse_args(argv=None):
+    parser = argparse.ArgumentParser(description="Replay recorded frames through the detection pipeline")
+    parser.add_argument('source', help="Video file, directory of images or synthetic:// URL")
+    parser.add_argument('--frames', type=int, default=0, help="Stop after this many decoded frames (0 = all)")
+    parser.add_argument('--loop', action='store_true', help="Repeat the source until --frames is reached")
+    parser.add_argument('--interval', type=int, default=5, help="Process every Nth decoded frame")
+    parser.add_argument('--batch-size', type=int, default=0, help="Frames per YOLO call (default YOLO_BATCH_SIZE)")
+    parser.add_argument('--motion', action='store_true', help="Apply motion gating like the live loop")
+    parser.add_argument('--output', help="Also write the JSON report to this file")
+    parser.add_argument('--compare-backends', metavar='NAMES',
+                        help="Comma-separated detector backends to check against ultralytics (e.g. onnxruntime,openvino)")
+    parser.add_argument('--int8', action='store_true', help="Compare the INT8-quantized ONNX model")
+    parser.add_argument('--min-parity', type=float, default=0.95,
+                        help="Minimum box recall and precision vs ultralytics for a backend to pass")
+    return parser.parse_args(argv)
+
+
+if __name__ == "__main__":
+    args = parse_args()
+    if args.loop and args.frames <= 0:
+        sys.exit("--loop needs --frames")
+
+    # Keep stdout for the report; pipeline log lines go to stderr
+    with contextlib.redirect_stdout(sys.stderr):
+        report = compare_backends(args) if args.compare_backends else run_benchmark(args)
+    text = json.dumps(report, indent=2)
+    print(text)
+    if args.output:
+        with open(args.output, 'w') as f:
+            f.write(text + '\n')
+
+    if not report.get('passed', True):
+        sys.exit(1)
@@ -175,7 +175,10 @@ TELEGRAM_BOT_TOKEN=8501083554:AAHZcpcdsMYOrgUkT8Asu3N0YX_SE9GrSTQ
 TELEGRAM_CHAT_ID=947624946
 
 # AI Detection Settings
-FRAME_PROCESS_INTERVAL=5
+ANALYSIS_ACTIVE_FPS=5
+ANALYSIS_IDLE_FPS=1
+TARGET_LATENCY_MS=1000
+CPU_BUDGET=80
 FRAME_RESIZE_WIDTH=640
 ZOOM_FACTOR=2
 CONFIDENCE_THRESHOLD=0.5
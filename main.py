@@ -10,23 +10,44 @@ import sys
 import time
 import threading
 import sqlite3
+import json
+import re
+import queue
+import bisect
+import importlib
+import atexit
+import base64
+import hashlib
+import shutil
+import signal
+import subprocess
+import tempfile
+import multiprocessing
+from multiprocessing import shared_memory
+from collections import deque
+from concurrent.futures import ThreadPoolExecutor
+
+# Reference point for the startup-time breakdown
+PROCESS_START_TIME = time.perf_counter()
+
 import cv2
 import numpy as np
 import asyncio
 from datetime import datetime, timedelta
 from pathlib import Path
+from urllib.parse import urlparse, parse_qs
 from dotenv import load_dotenv
 
-# AI & Computer Vision
-from ultralytics import YOLO
-import face_recognition
+# AI & Computer Vision: ultralytics (torch) and face_recognition (dlib) are
+# imported lazily by ModelLoader so the web and maintenance paths start fast
 
 # Web Framework
-from flask import Flask, render_template, request, redirect, url_for, session, Response, jsonify
+from flask import Flask, render_template, request, redirect, url_for, session, Response, jsonify, send_from_directory
 from flask_login import LoginManager, UserMixin, login_user, login_required, logout_user, current_user
 
 # Telegram Bot
-from telegram import Update, InputFile
+from telegram import Update, InputMediaPhoto
+from telegram.error import RetryAfter
 from telegram.ext import Application, CommandHandler, MessageHandler, filters, ContextTypes
 
 # Load environment variables
@@ -37,33 +58,235 @@ RTSP_URL = os.getenv('RTSP_URL', '')
 CAMERA_NAME = os.getenv('CAMERA_NAME', 'Kamera Depan')
 TELEGRAM_BOT_TOKEN = os.getenv('TELEGRAM_BOT_TOKEN', '')
 TELEGRAM_CHAT_ID = os.getenv('TELEGRAM_CHAT_ID', '')
-FRAME_PROCESS_INTERVAL = int(os.getenv('FRAME_PROCESS_INTERVAL', 5))
+TELEGRAM_RATE_PER_MINUTE = float(os.getenv('TELEGRAM_RATE_PER_MINUTE', 20))
+TELEGRAM_BURST = int(os.getenv('TELEGRAM_BURST', 4))
+TELEGRAM_MAX_BACKLOG = int(os.getenv('TELEGRAM_MAX_BACKLOG', 20))
+ANALYSIS_ACTIVE_FPS = float(os.getenv('ANALYSIS_ACTIVE_FPS', 5))
+ANALYSIS_IDLE_FPS = float(os.getenv('ANALYSIS_IDLE_FPS', 1))
+ANALYSIS_MIN_FPS = float(os.getenv('ANALYSIS_MIN_FPS', 0.2))
+TARGET_LATENCY_MS = float(os.getenv('TARGET_LATENCY_MS', 1000))
+CPU_BUDGET = float(os.getenv('CPU_BUDGET', 80))
+GOVERNOR_INTERVAL = float(os.getenv('GOVERNOR_INTERVAL', 2))
 FRAME_RESIZE_WIDTH = int(os.getenv('FRAME_RESIZE_WIDTH', 640))
 ZOOM_FACTOR = float(os.getenv('ZOOM_FACTOR', 2))
+SNAPSHOT_WIDTH = int(os.getenv('SNAPSHOT_WIDTH', 1920))
 CONFIDENCE_THRESHOLD = float(os.getenv('CONFIDENCE_THRESHOLD', 0.5))
+DETECTOR_BACKEND = os.getenv('DETECTOR_BACKEND', 'ultralytics')
+YOLO_WEIGHTS = os.getenv('YOLO_WEIGHTS', 'yolov8n.pt')
+DETECTOR_INPUT_SIZE = int(os.getenv('DETECTOR_INPUT_SIZE', 640))
+DETECTOR_INT8 = os.getenv('DETECTOR_INT8', '0') == '1'
+DETECTOR_THREADS = int(os.getenv('DETECTOR_THREADS', 0))
+# Same NMS threshold as the ultralytics predictor default
+DETECTOR_NMS_IOU = float(os.getenv('DETECTOR_NMS_IOU', 0.7))
 AUTO_DELETE_AFTER = int(os.getenv('AUTO_DELETE_AFTER', 7))
 CLEANUP_CHECK_INTERVAL = int(os.getenv('CLEANUP_CHECK_INTERVAL', 86400))
+RETENTION_MAX_GB = float(os.getenv('RETENTION_MAX_GB', 0))
+RETENTION_CHUNK_SIZE = int(os.getenv('RETENTION_CHUNK_SIZE', 500))
+RETENTION_CHUNK_PAUSE = float(os.getenv('RETENTION_CHUNK_PAUSE', 0.05))
+ORPHAN_GRACE_PERIOD = int(os.getenv('ORPHAN_GRACE_PERIOD', 3600))
 SECRET_KEY = os.getenv('SECRET_KEY', 'change-this-secret-key')
 WEB_USERNAME = os.getenv('WEB_USERNAME', 'admin')
 WEB_PASSWORD = os.getenv('WEB_PASSWORD', 'admin')
 WEB_PORT = int(os.getenv('WEB_PORT', 5000))
 WEB_HOST = os.getenv('WEB_HOST', '0.0.0.0')
+METRICS_TOKEN = os.getenv('METRICS_TOKEN', '')
 DATABASE_PATH = os.getenv('DATABASE_PATH', 'detections.db')
+CAPTURE_BUFFER_SIZE = int(os.getenv('CAPTURE_BUFFER_SIZE', 3))
+FRAME_POOL_SIZE = int(os.getenv('FRAME_POOL_SIZE', 8))
+CAPTURE_TRANSPORT = os.getenv('CAPTURE_TRANSPORT', 'tcp')
+CAPTURE_FFMPEG_BUFFER_SIZE = int(os.getenv('CAPTURE_FFMPEG_BUFFER_SIZE', 0))
+CAPTURE_OPEN_TIMEOUT_MS = int(os.getenv('CAPTURE_OPEN_TIMEOUT_MS', 10000))
+CAPTURE_READ_TIMEOUT_MS = int(os.getenv('CAPTURE_READ_TIMEOUT_MS', 10000))
+CAPTURE_STALL_TIMEOUT = float(os.getenv('CAPTURE_STALL_TIMEOUT', 15))
+CAPTURE_MAX_READ_FAILURES = int(os.getenv('CAPTURE_MAX_READ_FAILURES', 10))
+CAPTURE_RECONNECT_MIN = float(os.getenv('CAPTURE_RECONNECT_MIN', 1))
+CAPTURE_RECONNECT_MAX = float(os.getenv('CAPTURE_RECONNECT_MAX', 60))
+CAMERAS_CONFIG = os.getenv('CAMERAS_CONFIG', 'cameras.json')
+INFERENCE_WORKERS = int(os.getenv('INFERENCE_WORKERS', 2))
+INFERENCE_MODE = os.getenv('INFERENCE_MODE', 'thread')
+INFERENCE_PROCESSES = int(os.getenv('INFERENCE_PROCESSES', 0))
+INFERENCE_JOB_TIMEOUT = float(os.getenv('INFERENCE_JOB_TIMEOUT', 60))
+YOLO_BATCH_SIZE = int(os.getenv('YOLO_BATCH_SIZE', 4))
+YOLO_BATCH_TIMEOUT_MS = float(os.getenv('YOLO_BATCH_TIMEOUT_MS', 20))
+FACE_MATCH_TOLERANCE = float(os.getenv('FACE_MATCH_TOLERANCE', 0.6))
+FACE_REGION_RATIO = float(os.getenv('FACE_REGION_RATIO', 0.4))
+FACE_REGION_WIDTH = int(os.getenv('FACE_REGION_WIDTH', 256))
+FACE_REGION_MAX_UPSCALE = float(os.getenv('FACE_REGION_MAX_UPSCALE', 2))
+FACE_REUSE_DISTANCE = float(os.getenv('FACE_REUSE_DISTANCE', 0.45))
+FACE_REUSE_TTL = float(os.getenv('FACE_REUSE_TTL', 30))
+FACE_RETRY_INTERVAL = float(os.getenv('FACE_RETRY_INTERVAL', 1))
+TRACK_IOU_THRESHOLD = float(os.getenv('TRACK_IOU_THRESHOLD', 0.2))
+TRACK_MAX_AGE = float(os.getenv('TRACK_MAX_AGE', 5))
+TRACK_MIN_HITS = int(os.getenv('TRACK_MIN_HITS', 2))
+ALERT_REPEAT_AFTER = float(os.getenv('ALERT_REPEAT_AFTER', 0))
+MOTION_GATING = os.getenv('MOTION_GATING', '1') == '1'
+MOTION_WIDTH = int(os.getenv('MOTION_WIDTH', 160))
+MOTION_PIXEL_THRESHOLD = int(os.getenv('MOTION_PIXEL_THRESHOLD', 25))
+MOTION_MIN_AREA = float(os.getenv('MOTION_MIN_AREA', 0.002))
+MOTION_LEARNING_RATE = float(os.getenv('MOTION_LEARNING_RATE', 0.05))
+MOTION_HOLD = float(os.getenv('MOTION_HOLD', 2))
+STREAM_WIDTH = int(os.getenv('STREAM_WIDTH', 960))
+STREAM_JPEG_QUALITY = int(os.getenv('STREAM_JPEG_QUALITY', 70))
+STREAM_MAX_FPS = float(os.getenv('STREAM_MAX_FPS', 10))
+CLIP_RECORDING = os.getenv('CLIP_RECORDING', '1') == '1'
+CLIP_PRE_SECONDS = float(os.getenv('CLIP_PRE_SECONDS', 5))
+CLIP_POST_SECONDS = float(os.getenv('CLIP_POST_SECONDS', 10))
+CLIP_MAX_SECONDS = float(os.getenv('CLIP_MAX_SECONDS', 60))
+CLIP_FPS = float(os.getenv('CLIP_FPS', 5))
+CLIP_WIDTH = int(os.getenv('CLIP_WIDTH', 960))
+CLIP_JPEG_QUALITY = int(os.getenv('CLIP_JPEG_QUALITY', 70))
+CLIP_BUFFER_MAX_MB = float(os.getenv('CLIP_BUFFER_MAX_MB', 8))
+CLIP_CODEC = os.getenv('CLIP_CODEC', 'h264')
+DB_COMMIT_INTERVAL_MS = float(os.getenv('DB_COMMIT_INTERVAL_MS', 200))
+DB_MAX_BATCH = int(os.getenv('DB_MAX_BATCH', 500))
+DB_WRITE_QUEUE_SIZE = int(os.getenv('DB_WRITE_QUEUE_SIZE', 10000))
+IMAGE_WRITE_WORKERS = int(os.getenv('IMAGE_WRITE_WORKERS', 2))
+DASHBOARD_PAGE_SIZE = int(os.getenv('DASHBOARD_PAGE_SIZE', 48))
+THUMBNAIL_WIDTH = int(os.getenv('THUMBNAIL_WIDTH', 320))
+THUMBNAIL_JPEG_QUALITY = int(os.getenv('THUMBNAIL_JPEG_QUALITY', 75))
+MEDIA_MAX_AGE = int(os.getenv('MEDIA_MAX_AGE', 86400))
 
 # ============== DIRECTORIES ==============
 KNOWN_FACES_DIR = Path('known_faces')
 UPLOADS_DIR = Path('uploads')
+THUMBNAILS_DIR = UPLOADS_DIR / 'thumbs'
+CLIPS_DIR = UPLOADS_DIR / 'clips'
 LOGS_DIR = Path('logs')
 
-for dir_path in [KNOWN_FACES_DIR, UPLOADS_DIR, LOGS_DIR]:
+for dir_path in [KNOWN_FACES_DIR, UPLOADS_DIR, THUMBNAILS_DIR, CLIPS_DIR, LOGS_DIR]:
     dir_path.mkdir(exist_ok=True)
 
+# ============== METRICS ==============
+class Histogram:
+    """Thread-safe histogram with fixed upper-bound buckets"""
+    
+    def __init__(self, buckets):
+        self.buckets = sorted(buckets)
+        self.counts = [0] * (len(self.buckets) + 1)
+        self.count = 0
+        self.sum = 0.0
+        self.lock = threading.Lock()
+    
+    def observe(self, value):
+        index = bisect.bisect_left(self.buckets, value)
+        with self.lock:
+            self.counts[index] += 1
+            self.count += 1
+            self.sum += value
+    
+    def snapshot(self):
+        """Cumulative bucket counts keyed by upper bound"""
+        with self.lock:
+            cumulative = 0
+            buckets = {}
+            for bound, count in zip(self.buckets, self.counts):
+                cumulative += count
+                buckets[str(bound)] = cumulative
+            buckets['+Inf'] = self.count
+            return {'count': self.count, 'sum': self.sum, 'buckets': buckets}
+
+class Counter:
+    """Thread-safe monotonically increasing counter"""
+    
+    def __init__(self):
+        self.value = 0
+        self.lock = threading.Lock()
+    
+    def inc(self, amount=1):
+        with self.lock:
+            self.value += amount
+
+LATENCY_BUCKETS_MS = [5, 10, 25, 50, 100, 250, 500, 1000, 2500, 5000]
+
+batch_size_histogram = Histogram(range(1, YOLO_BATCH_SIZE + 1))
+batch_latency_histogram = Histogram(LATENCY_BUCKETS_MS)
+recognition_latency_histogram = Histogram(LATENCY_BUCKETS_MS)
+face_stage_histogram = Histogram(LATENCY_BUCKETS_MS)
+persons_per_frame_histogram = Histogram([0, 1, 2, 3, 4, 6, 8, 12, 20])
+face_attempts_counter = Counter()
+face_matches_counter = Counter()
+
+def estimated_frame_cost_ms():
+    """Average YOLO + recognition time spent on one processed frame"""
+    yolo = batch_latency_histogram.sum / batch_size_histogram.sum if batch_size_histogram.sum else 0.0
+    recognition = (recognition_latency_histogram.sum / recognition_latency_histogram.count
+                   if recognition_latency_histogram.count else 0.0)
+    return yolo + recognition
+
+def process_resource_usage():
+    """(rss_bytes, os_threads) from /proc, or None for either where unavailable"""
+    rss = threads = None
+    try:
+        with open('/proc/self/statm') as f:
+            rss = int(f.read().split()[1]) * os.sysconf('SC_PAGE_SIZE')
+        threads = len(os.listdir('/proc/self/task'))
+    except (OSError, ValueError, IndexError):
+        pass
+    return rss, threads
+
+def escape_label(value):
+    return str(value).replace('\\', '\\\\').replace('"', '\\"').replace('\n', '\\n')
+
+def format_labels(labels):
+    if not labels:
+        return ''
+    return '{' + ','.join(f'{key}="{escape_label(value)}"' for key, value in labels.items()) + '}'
+
+class MetricsWriter:
+    """Build a Prometheus text exposition (format 0.0.4) from plain values and histograms"""
+    
+    def __init__(self, prefix='riftech_'):
+        self.prefix = prefix
+        self.lines = []
+    
+    def metric(self, name, kind, help_text, samples):
+        """samples is a list of (labels, value); None values are skipped"""
+        name = self.prefix + name
+        self.lines.append(f'# HELP {name} {help_text}')
+        self.lines.append(f'# TYPE {name} {kind}')
+        for labels, value in samples:
+            if value is not None:
+                self.lines.append(f'{name}{format_labels(labels)} {value}')
+    
+    def gauge(self, name, help_text, samples):
+        self.metric(name, 'gauge', help_text, samples)
+    
+    def counter(self, name, help_text, samples):
+        self.metric(name, 'counter', help_text, samples)
+    
+    def histogram(self, name, help_text, histograms, scale=1.0):
+        """histograms is a list of (labels, Histogram); scale converts units (ms -> s)"""
+        name = self.prefix + name
+        self.lines.append(f'# HELP {name} {help_text}')
+        self.lines.append(f'# TYPE {name} histogram')
+        for labels, histogram in histograms:
+            snapshot = histogram.snapshot()
+            for bound, count in snapshot['buckets'].items():
+                le = bound if bound == '+Inf' else repr(float(bound) * scale)
+                self.lines.append(f'{name}_bucket{format_labels(dict(labels, le=le))} {count}')
+            self.lines.append(f"{name}_sum{format_labels(labels)} {snapshot['sum'] * scale}")
+            self.lines.append(f"{name}_count{format_labels(labels)} {snapshot['count']}")
+    
+    def render(self):
+        return '\n'.join(self.lines) + '\n'
+
 # ============== DATABASE SETUP ==============
+def get_db_connection():
+    """Open a connection that waits on locks instead of failing"""
+    conn = sqlite3.connect(DATABASE_PATH, timeout=30)
+    # Safe with WAL and much cheaper per commit than FULL
+    conn.execute('PRAGMA synchronous=NORMAL')
+    return conn
+
 def init_database():
     """Initialize SQLite database"""
-    conn = sqlite3.connect(DATABASE_PATH)
+    conn = get_db_connection()
     cursor = conn.cursor()
     
+    # WAL lets the dashboard read while the detection writer commits;
+    # the setting is stored in the database file
+    cursor.execute('PRAGMA journal_mode=WAL')
+    
     cursor.execute('''
         CREATE TABLE IF NOT EXISTS detections (
             id INTEGER PRIMARY KEY AUTOINCREMENT,
@@ -81,147 +304,2699 @@ def init_database():
         ON detections(timestamp)
     ''')
     
+    # Columns added after the first release
+    existing_columns = {row[1] for row in cursor.execute('PRAGMA table_info(detections)')}
+    for column in ('thumbnail_path', 'zoom_thumbnail_path', 'clip_path'):
+        if column not in existing_columns:
+            cursor.execute(f'ALTER TABLE detections ADD COLUMN {column} TEXT')
+    
+    # Thumbnails and clips are shared between rows; these back the
+    # reference check made before one is deleted
+    for column in SHARED_MEDIA_COLUMNS:
+        cursor.execute(f'''
+            CREATE INDEX IF NOT EXISTS idx_{column}
+            ON detections({column})
+        ''')
+    
+    # Composite indexes for the dashboard filters. Every index ends with the
+    # rowid (id), so each one already serves ORDER BY timestamp DESC, id DESC
+    # and the (timestamp, id) keyset condition without sorting
+    for column in ('status', 'camera_name', 'person_name'):
+        cursor.execute(f'''
+            CREATE INDEX IF NOT EXISTS idx_{column}_timestamp
+            ON detections({column}, timestamp)
+        ''')
+    
     conn.commit()
+    
+    # Refresh planner statistics when they are stale
+    cursor.execute('PRAGMA optimize')
     conn.close()
 
-def save_detection(timestamp, person_name, status, original_path, zoom_path, camera_name):
-    """Save detection to database"""
-    conn = sqlite3.connect(DATABASE_PATH)
-    cursor = conn.cursor()
+INSERT_DETECTION_SQL = '''
+    INSERT INTO detections (timestamp, person_name, status, original_photo_path, zoom_photo_path, camera_name,
+                            thumbnail_path, zoom_thumbnail_path)
+    VALUES (?, ?, ?, ?, ?, ?, ?, ?)
+'''
+
+def save_detection(timestamp, person_name, status, original_path, zoom_path, camera_name, images=(), on_written=None):
+    """Queue a detection and its [original, zoom] (path, frame) images for the background writer.
     
-    cursor.execute('''
-        INSERT INTO detections (timestamp, person_name, status, original_photo_path, zoom_photo_path, camera_name)
-        VALUES (?, ?, ?, ?, ?, ?)
-    ''', (timestamp, person_name, status, original_path, zoom_path, camera_name))
+    Each image is encoded once; the JPEG bytes are handed to on_written (for
+    the Telegram upload) and a thumbnail is stored for the dashboard.
+    """
+    def task():
+        jpegs = [write_jpeg(path, frame) for path, frame in images]
+        thumbnails = [write_thumbnail(frame) for _, frame in images]
+        thumbnails += [None] * (2 - len(thumbnails))
+        
+        if on_written:
+            on_written(jpegs)
+        
+        return [(INSERT_DETECTION_SQL, (timestamp, person_name, status, original_path, zoom_path, camera_name,
+                                        thumbnails[0], thumbnails[1]))]
     
-    conn.commit()
-    conn.close()
+    detection_writer.submit(task)
 
-def get_detections(limit=100, status=None):
-    """Get detections from database"""
-    conn = sqlite3.connect(DATABASE_PATH)
-    conn.row_factory = sqlite3.Row
-    cursor = conn.cursor()
+# Columns holding files under UPLOADS_DIR
+MEDIA_COLUMNS = ('original_photo_path', 'zoom_photo_path', 'thumbnail_path', 'zoom_thumbnail_path', 'clip_path')
+# Media columns whose files several rows may point to
+SHARED_MEDIA_COLUMNS = ('thumbnail_path', 'zoom_thumbnail_path', 'clip_path')
+
+# Columns the dashboard actually renders
+DETECTION_COLUMNS = ('id, timestamp, person_name, status, camera_name, original_photo_path, zoom_photo_path, '
+                     'thumbnail_path, zoom_thumbnail_path, clip_path')
+
+def encode_cursor(timestamp, detection_id):
+    """Opaque keyset cursor for the next page"""
+    return base64.urlsafe_b64encode(json.dumps([timestamp, detection_id]).encode()).decode()
+
+def decode_cursor(cursor):
+    try:
+        timestamp, detection_id = json.loads(base64.urlsafe_b64decode(cursor.encode()))
+        return str(timestamp), int(detection_id)
+    except (ValueError, TypeError):
+        raise ValueError('Invalid cursor')
+
+def get_detections(limit=100, status=None, camera_name=None, person_name=None,
+                   since=None, until=None, cursor=None):
+    """Get one page of detections, newest first.
+    
+    Uses keyset pagination on (timestamp, id): the cursor returned with a
+    page is passed back to get the next one, so deep pages cost the same as
+    the first. Returns (detections, next_cursor); next_cursor is None on the
+    last page.
+    """
+    conditions = []
+    params = []
     
     if status:
-        cursor.execute('''
-            SELECT * FROM detections 
-            WHERE status = ?
-            ORDER BY timestamp DESC 
+        conditions.append('status = ?')
+        params.append(status)
+    if camera_name:
+        conditions.append('camera_name = ?')
+        params.append(camera_name)
+    if person_name:
+        conditions.append('person_name = ?')
+        params.append(person_name)
+    if since:
+        conditions.append('timestamp >= ?')
+        params.append(since)
+    if until:
+        conditions.append('timestamp < ?')
+        params.append(until)
+    if cursor:
+        conditions.append('(timestamp, id) < (?, ?)')
+        params.extend(decode_cursor(cursor))
+    
+    where = f"WHERE {' AND '.join(conditions)}" if conditions else ''
+    
+    conn = get_db_connection()
+    conn.row_factory = sqlite3.Row
+    cursor_db = conn.cursor()
+    
+    # Fetch one extra row to know whether another page exists
+    cursor_db.execute(f'''
+        SELECT {DETECTION_COLUMNS} FROM detections
+        {where}
+        ORDER BY timestamp DESC, id DESC
+        LIMIT ?
+    ''', params + [limit + 1])
+    
+    detections = cursor_db.fetchall()
+    conn.close()
+    
+    next_cursor = None
+    if len(detections) > limit:
+        detections = detections[:limit]
+        next_cursor = encode_cursor(detections[-1]['timestamp'], detections[-1]['id'])
+    
+    return detections, next_cursor
+
+# ============== DETECTION PERSISTENCE ==============
+class DetectionWriter:
+    """Persist detections off the inference path.
+    
+    JPEG encoding and file writes run on a small thread pool. Once a
+    detection's images are on disk its row goes through a queue to a single
+    writer thread, which holds one long-lived WAL-mode connection and
+    commits everything that arrived within DB_COMMIT_INTERVAL_MS (up to
+    DB_MAX_BATCH statements) in one transaction.
+    """
+    
+    def __init__(self):
+        self.queue = queue.Queue(maxsize=DB_WRITE_QUEUE_SIZE)
+        self.image_pool = ThreadPoolExecutor(max_workers=max(1, IMAGE_WRITE_WORKERS),
+                                             thread_name_prefix='image-writer')
+        self.lock = threading.Lock()
+        self.thread = None
+        self.pending_images = 0
+        self.rows_written = 0
+        self.write_errors = 0
+        self.commit_latency = Histogram(LATENCY_BUCKETS_MS)
+        self.commit_size = Histogram([1, 2, 5, 10, 25, 50, 100, 250, 500])
+    
+    def start(self):
+        with self.lock:
+            if self.thread is None:
+                self.thread = threading.Thread(target=self._run, name="db-writer", daemon=True)
+                self.thread.start()
+    
+    def submit(self, task):
+        """Run task on the image pool, then queue the (sql, params) statements it returns"""
+        self.start()
+        with self.lock:
+            self.pending_images += 1
+        self.image_pool.submit(self._run_task, task)
+    
+    def execute(self, sql, params):
+        """Queue a statement for the next group commit"""
+        self.start()
+        self.queue.put((sql, params))
+    
+    def _run_task(self, task):
+        try:
+            for statement in task() or ():
+                self.queue.put(statement)
+        except Exception as e:
+            self.write_errors += 1
+            print(f"[DB Writer Error] Failed to write images: {e}")
+        finally:
+            with self.lock:
+                self.pending_images -= 1
+    
+    def _run(self):
+        conn = get_db_connection()
+        running = True
+        
+        while running:
+            batch = [self.queue.get()]
+            deadline = time.monotonic() + DB_COMMIT_INTERVAL_MS / 1000
+            
+            # Gather more statements for this transaction
+            while len(batch) < DB_MAX_BATCH and batch[-1] is not None:
+                remaining = deadline - time.monotonic()
+                try:
+                    batch.append(self.queue.get(timeout=remaining) if remaining > 0 else self.queue.get_nowait())
+                except queue.Empty:
+                    break
+            
+            # None is the shutdown sentinel; commit what came before it
+            if batch[-1] is None:
+                batch.pop()
+                running = False
+            
+            if not batch:
+                continue
+            
+            start_time = time.perf_counter()
+            try:
+                with conn:
+                    for sql, params in batch:
+                        conn.execute(sql, params)
+                self.rows_written += len(batch)
+            except sqlite3.Error as e:
+                self.write_errors += len(batch)
+                print(f"[DB Writer Error] Failed to commit {len(batch)} statement(s): {e}")
+            
+            self.commit_latency.observe((time.perf_counter() - start_time) * 1000)
+            self.commit_size.observe(len(batch))
+        
+        conn.close()
+    
+    def stop(self):
+        """Finish pending image writes and flush every queued row"""
+        self.image_pool.shutdown(wait=True)
+        with self.lock:
+            thread = self.thread
+        if thread is not None:
+            self.queue.put(None)
+            thread.join(timeout=30)
+    
+    def stats(self):
+        return {
+            'queue_depth': self.queue.qsize(),
+            'pending_images': self.pending_images,
+            'rows_written': self.rows_written,
+            'write_errors': self.write_errors,
+            'commit_latency_ms': self.commit_latency.snapshot(),
+            'commit_size': self.commit_size.snapshot(),
+        }
+
+def write_jpeg(path, frame, quality=95):
+    """Encode a frame, write it to path and return the JPEG bytes"""
+    ret, buffer = cv2.imencode('.jpg', frame, [cv2.IMWRITE_JPEG_QUALITY, quality])
+    if not ret:
+        raise ValueError(f"JPEG encoding failed for {path}")
+    jpeg = buffer.tobytes()
+    with open(path, 'wb') as f:
+        f.write(jpeg)
+    return jpeg
+
+def write_thumbnail(frame):
+    """Store a small JPEG in the content-addressed thumbnail cache and return its path.
+    
+    Files are named after the SHA-1 of their bytes, so a path never changes
+    content and can be cached by browsers forever.
+    """
+    height, width = frame.shape[:2]
+    if width > THUMBNAIL_WIDTH:
+        frame = cv2.resize(frame, (THUMBNAIL_WIDTH, int(height * THUMBNAIL_WIDTH / width)),
+                           interpolation=cv2.INTER_AREA)
+    
+    ret, buffer = cv2.imencode('.jpg', frame, [cv2.IMWRITE_JPEG_QUALITY, THUMBNAIL_JPEG_QUALITY])
+    if not ret:
+        raise ValueError("Thumbnail encoding failed")
+    jpeg = buffer.tobytes()
+    
+    digest = hashlib.sha1(jpeg).hexdigest()
+    path = THUMBNAILS_DIR / digest[:2] / f"{digest}.jpg"
+    if not path.exists():
+        path.parent.mkdir(exist_ok=True)
+        # Writers producing the same thumbnail each need their own temp file
+        with tempfile.NamedTemporaryFile(dir=path.parent, suffix='.tmp', delete=False) as f:
+            f.write(jpeg)
+        os.replace(f.name, path)
+    return str(path)
+
+detection_writer = DetectionWriter()
+# Flush pending detections on normal interpreter exit
+atexit.register(detection_writer.stop)
+
+# ============== RETENTION ==============
+def remove_files(paths):
+    """Delete files that exist and return (count, bytes) removed"""
+    removed = freed = 0
+    for path in paths:
+        if not path:
+            continue
+        try:
+            size = os.path.getsize(path)
+            os.remove(path)
+        except FileNotFoundError:
+            continue
+        except OSError as e:
+            print(f"Error deleting files: {e}")
+            continue
+        removed += 1
+        freed += size
+    return removed, freed
+
+def unreferenced_files(conn, paths):
+    """Drop the paths that a remaining detection still points to.
+    
+    Thumbnails are content-addressed, so identical crops share one file,
+    and every detection of an event links the same clip; such a file may
+    only go with the last row using it. Call after the delete.
+    """
+    paths = list(dict.fromkeys(path for path in paths if path))
+    if not paths:
+        return paths
+    shared = set()
+    for column in SHARED_MEDIA_COLUMNS:
+        shared.update(row[0] for row in conn.execute(
+            f"SELECT {column} FROM detections WHERE {column} IN ({', '.join('?' * len(paths))})", paths))
+    return [path for path in paths if path not in shared]
+
+def retention_media():
+    """Paths of the files under UPLOADS_DIR that retention may delete.
+    
+    Only files this app writes for detections count: det_* photos,
+    thumbnails and clips, never dotfiles such as .gitkeep or the photos
+    sent to the bot.
+    """
+    media_dirs = {os.path.normpath(THUMBNAILS_DIR), os.path.normpath(CLIPS_DIR)}
+    for root, _, files in os.walk(UPLOADS_DIR):
+        in_media_dir = any(root == media_dir or root.startswith(media_dir + os.sep) for media_dir in media_dirs)
+        for name in files:
+            if name.startswith('.') or not (in_media_dir or name.startswith('det_')):
+                continue
+            yield os.path.normpath(os.path.join(root, name))
+
+def media_usage():
+    """Total size in bytes of the files retention_media() yields"""
+    total = 0
+    for path in retention_media():
+        try:
+            total += os.path.getsize(path)
+        except OSError:
+            pass
+    return total
+
+class RetentionCleaner:
+    """Expire detections in small chunks so the database is never locked for long.
+    
+    Each chunk is the oldest RETENTION_CHUNK_SIZE matching rows; they are
+    removed with one range DELETE in their own short transaction, their files
+    are deleted after the commit, and the cleaner sleeps briefly before the
+    next chunk so the detection writer can get in. Runs in the cleanup thread,
+    never on the writer thread.
+    """
+    
+    def __init__(self):
+        self.lock = threading.Lock()
+        self.phase = 'idle'
+        self.runs = 0
+        self.last_run = None
+        self.last_duration = None
+        self.last_error = None
+        self.run_rows_deleted = 0
+        self.rows_deleted = 0
+        self.files_deleted = 0
+        self.orphans_deleted = 0
+        self.bytes_freed = 0
+        self.disk_usage = None
+    
+    def run(self):
+        """Apply age limits, the disk cap and the orphan sweep once"""
+        if not self.lock.acquire(blocking=False):
+            return
+        
+        start_time = time.monotonic()
+        self.run_rows_deleted = 0
+        try:
+            conn = get_db_connection()
+            conn.row_factory = sqlite3.Row
+            try:
+                self.phase = 'age'
+                self.expire_by_age(conn)
+                if RETENTION_MAX_GB > 0:
+                    self.phase = 'disk'
+                    self.enforce_disk_cap(conn)
+                self.phase = 'orphans'
+                self.sweep_orphans(conn)
+            finally:
+                conn.close()
+            self.last_error = None
+        except Exception as e:
+            self.last_error = str(e)
+            print(f"[Cleanup Error] {e}")
+        finally:
+            self.phase = 'idle'
+            self.runs += 1
+            self.last_run = datetime.now().isoformat()
+            self.last_duration = time.monotonic() - start_time
+            self.lock.release()
+        
+        if self.run_rows_deleted:
+            print(f"[Cleanup] Deleted {self.run_rows_deleted} old detections in {self.last_duration:.1f}s")
+    
+    def retention_rules(self):
+        """(where, params) per retention period; cameras may set retention_days"""
+        try:
+            configs = load_camera_config()
+        except (OSError, ValueError) as e:
+            print(f"[Cleanup] Ignoring per-camera retention: {e}")
+            configs = []
+        
+        overrides = {config['name']: config['retention_days'] for config in configs
+                     if config.get('retention_days') is not None}
+        
+        rules = []
+        now = datetime.now()
+        for camera_name, days in overrides.items():
+            if days > 0:
+                cutoff = (now - timedelta(days=days)).isoformat()
+                rules.append(('camera_name = ? AND timestamp < ?', (camera_name, cutoff)))
+        
+        if AUTO_DELETE_AFTER > 0:
+            cutoff = (now - timedelta(days=AUTO_DELETE_AFTER)).isoformat()
+            placeholders = ', '.join('?' * len(overrides))
+            # NOT IN never matches NULL, so rows without a camera are listed explicitly
+            rules.append((f'(camera_name IS NULL OR camera_name NOT IN ({placeholders})) AND timestamp < ?',
+                          (*overrides, cutoff)))
+        return rules
+    
+    def expire_by_age(self, conn):
+        for where, params in self.retention_rules():
+            while self.delete_chunk(conn, where, params)[0]:
+                time.sleep(RETENTION_CHUNK_PAUSE)
+    
+    def enforce_disk_cap(self, conn):
+        """Delete the oldest detections until their media fits in RETENTION_MAX_GB"""
+        limit = RETENTION_MAX_GB * 1024 ** 3
+        self.disk_usage = media_usage()
+        while self.disk_usage > limit:
+            _, freed = self.delete_chunk(conn, '1', ())
+            # Nothing left to delete, or the oldest rows' files are still shared
+            if not freed:
+                break
+            self.disk_usage -= freed
+            time.sleep(RETENTION_CHUNK_PAUSE)
+    
+    def delete_chunk(self, conn, where, params):
+        """Delete the oldest chunk of rows matching where; returns (rows deleted, bytes freed)"""
+        rows = conn.execute(f'''
+            SELECT id, timestamp, {', '.join(MEDIA_COLUMNS)}
+            FROM detections
+            WHERE {where}
+            ORDER BY timestamp, id
             LIMIT ?
-        ''', (status, limit))
+        ''', (*params, RETENTION_CHUNK_SIZE)).fetchall()
+        if not rows:
+            return 0, 0
+        
+        # One set-based delete over the (timestamp, id) range just read
+        last = rows[-1]
+        with conn:
+            deleted = conn.execute(f'DELETE FROM detections WHERE {where} AND (timestamp, id) <= (?, ?)',
+                                   (*params, last['timestamp'], last['id'])).rowcount
+        
+        paths = unreferenced_files(conn, (row[column] for row in rows for column in MEDIA_COLUMNS))
+        removed, freed = remove_files(paths)
+        self.run_rows_deleted += deleted
+        self.rows_deleted += deleted
+        self.files_deleted += removed
+        self.bytes_freed += freed
+        return deleted, freed
+    
+    def sweep_orphans(self, conn):
+        """Remove files under UPLOADS_DIR that no detection refers to.
+        
+        Only retention_media() is considered. Files younger than
+        ORPHAN_GRACE_PERIOD are kept: a detection's images are written
+        before its row is committed.
+        """
+        referenced = set()
+        for row in conn.execute(f"SELECT {', '.join(MEDIA_COLUMNS)} FROM detections"):
+            referenced.update(os.path.normpath(path) for path in row if path)
+        
+        cutoff = time.time() - ORPHAN_GRACE_PERIOD
+        orphans = []
+        for path in retention_media():
+            if path in referenced:
+                continue
+            try:
+                if os.path.getmtime(path) < cutoff:
+                    orphans.append(path)
+            except OSError:
+                pass
+        
+        removed, freed = remove_files(orphans)
+        self.orphans_deleted += removed
+        self.bytes_freed += freed
+        if removed:
+            print(f"[Cleanup] Removed {removed} orphaned files")
+    
+    def stats(self):
+        return {
+            'phase': self.phase,
+            'runs': self.runs,
+            'last_run': self.last_run,
+            'last_duration_s': self.last_duration,
+            'last_error': self.last_error,
+            'rows_deleted_this_run': self.run_rows_deleted,
+            'rows_deleted': self.rows_deleted,
+            'files_deleted': self.files_deleted,
+            'orphans_deleted': self.orphans_deleted,
+            'bytes_freed': self.bytes_freed,
+            'disk_usage_bytes': self.disk_usage,
+        }
+
+retention_cleaner = RetentionCleaner()
+
+# ============== FACE RECOGNITION ==============
+class FaceEncodingCache:
+    """Persisted face encodings keyed by image path, mtime and size.
+    
+    Encodings are stored as a (N, 128) float32 .npy file that is memory-mapped
+    on load; the JSON file next to it holds the path, stat key, name and row
+    of every image. Images without a detectable face are cached with no row
+    so they are not re-scanned on every start.
+    """
+    
+    def __init__(self, directory):
+        self.encodings_path = directory / '.encodings.npy'
+        self.index_path = directory / '.encodings.json'
+        self.entries = {}
+        self.encodings = np.zeros((0, FaceIndex.DIMENSIONS), dtype=np.float32)
+        self.lock = threading.Lock()
+    
+    def load(self):
+        """Load the cache from disk; a missing or corrupt cache starts empty"""
+        try:
+            with open(self.index_path) as f:
+                entries = json.load(f)
+            encodings = np.load(self.encodings_path, mmap_mode='r')
+        except (OSError, ValueError) as e:
+            if self.index_path.exists():
+                print(f"[Face Cache] Ignoring unreadable cache: {e}")
+            return
+        
+        if any(entry['row'] is not None and entry['row'] >= len(encodings) for entry in entries):
+            print("[Face Cache] Ignoring inconsistent cache")
+            return
+        
+        self.entries = {entry['path']: entry for entry in entries}
+        self.encodings = encodings
+    
+    def lookup(self, path, stat):
+        """Return (hit, encoding); encoding is None for images without a face"""
+        entry = self.entries.get(str(path))
+        
+        if not entry or entry['mtime_ns'] != stat.st_mtime_ns or entry['size'] != stat.st_size:
+            return False, None
+        
+        if entry['row'] is None:
+            return True, None
+        
+        return True, self.encodings[entry['row']]
+    
+    def rebuild(self, records):
+        """Replace the cache with (path, stat, name, encoding) records and persist it"""
+        rows = []
+        self.entries = {}
+        
+        for path, stat, name, encoding in records:
+            row = None
+            if encoding is not None:
+                row = len(rows)
+                rows.append(encoding)
+            self.entries[str(path)] = self._entry(path, stat, name, row)
+        
+        self.encodings = np.asarray(rows, dtype=np.float32).reshape(-1, FaceIndex.DIMENSIONS)
+        self.save()
+    
+    def put(self, path, name, encoding):
+        """Add or replace a single image's encoding and persist it"""
+        row = len(self.encodings)
+        self.encodings = np.vstack([self.encodings, np.asarray(encoding, dtype=np.float32).reshape(1, -1)])
+        self.entries[str(path)] = self._entry(path, path.stat(), name, row)
+        self.save()
+    
+    def save(self):
+        """Write both files atomically"""
+        tmp_encodings = self.encodings_path.with_suffix('.tmp')
+        with open(tmp_encodings, 'wb') as f:
+            np.save(f, np.ascontiguousarray(self.encodings, dtype=np.float32))
+        os.replace(tmp_encodings, self.encodings_path)
+        
+        tmp_index = self.index_path.with_suffix('.tmp')
+        with open(tmp_index, 'w') as f:
+            json.dump(list(self.entries.values()), f)
+        os.replace(tmp_index, self.index_path)
+    
+    @staticmethod
+    def _entry(path, stat, name, row):
+        return {
+            'path': str(path),
+            'mtime_ns': stat.st_mtime_ns,
+            'size': stat.st_size,
+            'name': name,
+            'row': row,
+        }
+
+def encode_known_face(image_path):
+    """Encode the first face found in a known_faces image"""
+    # Load image and detect faces
+    image = face_recognition.load_image_file(str(image_path))
+    
+    # Detect face locations using HOG (CPU optimized)
+    face_locations = face_recognition.face_locations(image, model='hog')
+    
+    if not face_locations:
+        return None
+    
+    # Get first face encoding
+    return face_recognition.face_encodings(image, face_locations[:1])[0]
+
+def load_known_faces():
+    """Load known faces from known_faces directory, re-encoding only new or changed images"""
+    with face_cache.lock:
+        if not face_cache.entries:
+            face_cache.load()
+        
+        records = []
+        known_names = []
+        rows = []
+        encoded = 0
+        
+        for image_path in sorted(KNOWN_FACES_DIR.glob('*.jpg')):
+            stat = image_path.stat()
+            hit, face_encoding = face_cache.lookup(image_path, stat)
+            
+            if hit:
+                entry = face_cache.entries[str(image_path)]
+                if entry['row'] is not None:
+                    rows.append(entry['row'])
+            else:
+                face_encoding = encode_known_face(image_path)
+                encoded += 1
+            
+            records.append((image_path, stat, image_path.stem, face_encoding))
+            if face_encoding is not None:
+                known_names.append(image_path.stem)
+        
+        if encoded or len(records) != len(face_cache.entries) or rows != list(range(len(face_cache.encodings))):
+            # Compacts the cache so rows follow known_names order again
+            face_cache.rebuild(records)
+            if encoded:
+                print(f"[Face Cache] Encoded {encoded} new or changed image(s)")
+        
+        # Unchanged caches are served straight from the memory-mapped file
+        return face_cache.encodings, known_names
+
+def enroll_face(name, rgb_image, face_location):
+    """Save a face to known_faces and add it to the index without a full reload"""
+    top, right, bottom, left = face_location
+    face_image = rgb_image[top:bottom, left:right]
+    
+    # Encode from the full image so the face does not need to be re-detected
+    face_encoding = face_recognition.face_encodings(rgb_image, [face_location])[0]
+    
+    # Save to known_faces
+    face_path = KNOWN_FACES_DIR / f"{name}.jpg"
+    cv2.imwrite(str(face_path), cv2.cvtColor(face_image, cv2.COLOR_RGB2BGR))
+    
+    with face_cache.lock:
+        face_cache.put(face_path, name, face_encoding)
+    face_index.add(name, face_encoding)
+
+class FaceIndex:
+    """Known face encodings stored as a contiguous float32 (N, 128) matrix.
+    
+    Squared norms are precomputed so a lookup is a single matrix product
+    against every enrolled face. Updates build new arrays and swap them in
+    atomically, so readers never need a lock.
+    """
+    
+    DIMENSIONS = 128
+    
+    def __init__(self, encodings=(), names=()):
+        self.lock = threading.Lock()
+        self._set(encodings, names)
+    
+    def _set(self, encodings, names):
+        matrix = np.ascontiguousarray(np.asarray(encodings, dtype=np.float32).reshape(-1, self.DIMENSIONS))
+        norms_sq = np.einsum('ij,ij->i', matrix, matrix)
+        self._state = (matrix, norms_sq, list(names))
+    
+    def __len__(self):
+        return len(self._state[2])
+    
+    @property
+    def names(self):
+        return list(self._state[2])
+    
+    def replace(self, encodings, names):
+        """Swap in a completely new set of known faces"""
+        with self.lock:
+            self._set(encodings, names)
+    
+    def add(self, name, encoding):
+        """Add a face, replacing any existing entry with the same name"""
+        with self.lock:
+            matrix, _, names = self._state
+            keep = [i for i, existing in enumerate(names) if existing != name]
+            encodings = np.vstack([matrix[keep], np.asarray(encoding, dtype=np.float32).reshape(1, -1)])
+            self._set(encodings, [names[i] for i in keep] + [name])
+    
+    def match(self, encodings, tolerance=FACE_MATCH_TOLERANCE):
+        """Return (name, distance) of the nearest known face for each query.
+        
+        name is None when the nearest face is farther than tolerance;
+        distance is None when the index is empty.
+        """
+        queries = np.asarray(encodings, dtype=np.float32).reshape(-1, self.DIMENSIONS)
+        matrix, norms_sq, names = self._state
+        
+        if not names:
+            return [(None, None)] * len(queries)
+        
+        # ||q - k||^2 = ||q||^2 + ||k||^2 - 2 q.k for all pairs at once
+        distances_sq = norms_sq[np.newaxis, :] - 2 * (queries @ matrix.T)
+        distances_sq += np.einsum('ij,ij->i', queries, queries)[:, np.newaxis]
+        
+        nearest = np.argmin(distances_sq, axis=1)
+        distances = np.sqrt(np.maximum(distances_sq[np.arange(len(queries)), nearest], 0))
+        
+        return [
+            (names[index] if distance <= tolerance else None, float(distance))
+            for index, distance in zip(nearest, distances)
+        ]
+
+def encode_face(face_image):
+    """Detect the first face in an image and return (encoding, location)"""
+    try:
+        # Detect faces using HOG
+        face_locations = face_recognition.face_locations(face_image, model='hog')
+        
+        if not face_locations:
+            return None, None
+        
+        # Get face encoding
+        face_encoding = face_recognition.face_encodings(face_image, face_locations[:1])[0]
+        return face_encoding, face_locations[0]
+    
+    except Exception as e:
+        print(f"[Face Recognition Error] {e}")
+        return None, None
+
+def face_search_region(frame, bbox):
+    """Cut the head/upper-body part of a person box, normalized for HOG.
+    
+    Returns (rgb_region, scale, offset). The region is the top
+    FACE_REGION_RATIO of the box, resized to FACE_REGION_WIDTH pixels wide
+    (upscaling at most FACE_REGION_MAX_UPSCALE) so crop size is capped no
+    matter the camera resolution.
+    """
+    frame_height, frame_width = frame.shape[:2]
+    x1, y1, x2, y2 = bbox
+    x1, y1 = max(0, x1), max(0, y1)
+    x2, y2 = min(frame_width, x2), min(frame_height, y2)
+    
+    region_height = max(1, int((y2 - y1) * FACE_REGION_RATIO))
+    region = frame[y1:y1 + region_height, x1:x2]
+    
+    if region.size == 0:
+        return None, 1.0, (x1, y1)
+    
+    scale = min(FACE_REGION_WIDTH / region.shape[1], FACE_REGION_MAX_UPSCALE)
+    if abs(scale - 1) > 0.05:
+        interpolation = cv2.INTER_AREA if scale < 1 else cv2.INTER_LINEAR
+        region = cv2.resize(region, None, fx=scale, fy=scale, interpolation=interpolation)
+    
+    # face_recognition expects RGB, camera frames are BGR
+    return cv2.cvtColor(region, cv2.COLOR_BGR2RGB), scale, (x1, y1)
+
+# ============== TRACKING ==============
+def bbox_iou(a, b):
+    """Intersection over union of two (x1, y1, x2, y2) boxes"""
+    inter_w = min(a[2], b[2]) - max(a[0], b[0])
+    inter_h = min(a[3], b[3]) - max(a[1], b[1])
+    if inter_w <= 0 or inter_h <= 0:
+        return 0.0
+    intersection = inter_w * inter_h
+    union = (a[2] - a[0]) * (a[3] - a[1]) + (b[2] - b[0]) * (b[3] - b[1]) - intersection
+    return intersection / union if union > 0 else 0.0
+
+class Track:
+    """A tracked person: constant-velocity Kalman filter on (cx, cy, w, h).
+    
+    Besides the motion state, a track carries the identity found by face
+    recognition and when it was last alerted, so both happen once per
+    person rather than once per processed frame.
+    """
+    
+    # x' = F x with F = [[I, dt*I], [0, I]], measurement is the box itself
+    MEASUREMENT = np.hstack([np.eye(4), np.zeros((4, 4))])
+    
+    def __init__(self, track_id, bbox, now):
+        self.id = track_id
+        self.state = np.concatenate([self._measure(bbox), np.zeros(4)])
+        height = max(self.state[3], 1)
+        self.covariance = np.diag([(height / 10) ** 2] * 4 + [(height / 2) ** 2] * 4)
+        self.bbox = bbox
+        self.hits = 1
+        self.first_seen = now
+        self.last_seen = now
+        self.state_time = now
+        
+        # Identity and alerting
+        self.person_name = None
+        self.face_distance = None
+        self.identified_at = None
+        self.last_recognition = None
+        self.alerted_at = None
+    
+    @staticmethod
+    def _measure(bbox):
+        x1, y1, x2, y2 = bbox
+        return np.array([(x1 + x2) / 2, (y1 + y2) / 2, x2 - x1, y2 - y1], dtype=float)
+    
+    def _state_bbox(self):
+        cx, cy, w, h = self.state[:4]
+        return (int(cx - w / 2), int(cy - h / 2), int(cx + w / 2), int(cy + h / 2))
+    
+    def predict(self, now):
+        """Advance the state to time now and return the predicted box"""
+        dt = max(now - self.state_time, 0.0)
+        transition = np.eye(8)
+        transition[:4, 4:] = np.eye(4) * dt
+        
+        height = max(self.state[3], 1)
+        noise = np.diag([(height / 20) ** 2] * 4 + [(height / 10) ** 2] * 4) * max(dt, 0.01)
+        
+        self.state = transition @ self.state
+        self.covariance = transition @ self.covariance @ transition.T + noise
+        self.state_time = now
+        return self._state_bbox()
+    
+    def correct(self, bbox, now):
+        """Fold a matched detection into the state"""
+        height = max(self.state[3], 1)
+        measurement_noise = np.eye(4) * (height / 20) ** 2
+        
+        innovation = self._measure(bbox) - self.MEASUREMENT @ self.state
+        innovation_cov = self.MEASUREMENT @ self.covariance @ self.MEASUREMENT.T + measurement_noise
+        gain = self.covariance @ self.MEASUREMENT.T @ np.linalg.inv(innovation_cov)
+        
+        self.state = self.state + gain @ innovation
+        self.covariance = (np.eye(8) - gain @ self.MEASUREMENT) @ self.covariance
+        self.bbox = bbox
+        self.hits += 1
+        self.last_seen = now
+    
+    def is_identified(self, now):
+        """True while a confident face match is still fresh"""
+        return self.identified_at is not None and now - self.identified_at <= FACE_REUSE_TTL
+    
+    def needs_recognition(self, now):
+        if self.is_identified(now):
+            return False
+        return self.last_recognition is None or now - self.last_recognition >= FACE_RETRY_INTERVAL
+    
+    def set_identity(self, person_name, distance, now):
+        self.person_name = person_name
+        self.face_distance = distance
+        if person_name and distance is not None and distance <= FACE_REUSE_DISTANCE:
+            self.identified_at = now
+
+class PersonTracker:
+    """Give each person a stable ID across frames (IoU matching + Kalman prediction).
+    
+    Detections are matched greedily to predicted track boxes by IoU, with a
+    centroid-distance fallback for fast movers. Tracks unseen for
+    TRACK_MAX_AGE seconds are evicted, keeping memory bounded.
+    """
+    
+    def __init__(self):
+        self.tracks = {}
+        self.next_id = 1
+    
+    def update(self, bboxes, now):
+        """Match boxes to tracks and return the Track for each box, in order"""
+        tracks = list(self.tracks.values())
+        predicted = [track.predict(now) for track in tracks]
+        assigned = [None] * len(bboxes)
+        free_tracks = set(range(len(tracks)))
+        
+        # Greedy IoU matching, best overlaps first
+        candidates = []
+        for ti, track_box in enumerate(predicted):
+            for di, bbox in enumerate(bboxes):
+                iou = bbox_iou(track_box, bbox)
+                if iou >= TRACK_IOU_THRESHOLD:
+                    candidates.append((iou, ti, di))
+        
+        for _, ti, di in sorted(candidates, reverse=True):
+            if ti in free_tracks and assigned[di] is None:
+                assigned[di] = tracks[ti]
+                free_tracks.discard(ti)
+        
+        # Centroid fallback: within half a box height of the prediction
+        candidates = []
+        for ti in free_tracks:
+            tx1, ty1, tx2, ty2 = predicted[ti]
+            max_distance = max(ty2 - ty1, 1) / 2
+            for di, bbox in enumerate(bboxes):
+                if assigned[di] is not None:
+                    continue
+                distance = np.hypot((bbox[0] + bbox[2] - tx1 - tx2) / 2, (bbox[1] + bbox[3] - ty1 - ty2) / 2)
+                if distance <= max_distance:
+                    candidates.append((distance, ti, di))
+        
+        for _, ti, di in sorted(candidates):
+            if ti in free_tracks and assigned[di] is None:
+                assigned[di] = tracks[ti]
+                free_tracks.discard(ti)
+        
+        for di, bbox in enumerate(bboxes):
+            if assigned[di] is None:
+                track = Track(self.next_id, bbox, now)
+                self.next_id += 1
+                self.tracks[track.id] = track
+                assigned[di] = track
+            else:
+                assigned[di].correct(bbox, now)
+        
+        # Evict tracks that have not been seen for a while
+        for track_id in [tid for tid, track in self.tracks.items() if now - track.last_seen > TRACK_MAX_AGE]:
+            del self.tracks[track_id]
+        
+        return assigned
+    
+    def identified_boxes(self, now):
+        """Last boxes of tracks whose identity is reused, so their faces need no encoding"""
+        return [track.bbox for track in self.tracks.values() if not track.needs_recognition(now)]
+    
+    def stats(self):
+        return {'active_tracks': len(self.tracks), 'tracks_created': self.next_id - 1}
+
+# ============== PERSON DETECTOR ==============
+class UltralyticsDetector:
+    """YOLO through ultralytics and eager PyTorch"""
+    
+    name = 'ultralytics'
+    
+    def __init__(self, weights=YOLO_WEIGHTS):
+        self.model = importlib.import_module('ultralytics').YOLO(weights)
+    
+    def detect(self, images, confidence=CONFIDENCE_THRESHOLD, input_size=None):
+        """Person boxes per image as lists of (x1, y1, x2, y2, confidence) in image pixels"""
+        results = self.model(images, classes=[0], conf=confidence, verbose=False,
+                             imgsz=input_size or DETECTOR_INPUT_SIZE)
+        detections = []
+        for result in results:
+            boxes = result.boxes
+            xyxy = boxes.xyxy.cpu().numpy()
+            conf = boxes.conf.cpu().numpy()
+            detections.append([(*box, float(score)) for box, score in zip(xyxy.tolist(), conf)])
+        return detections
+
+class OnnxDetector:
+    """Shared pre/post-processing for a YOLOv8 model exported to ONNX.
+    
+    Images are letterboxed to DETECTOR_INPUT_SIZE (or the input_size of a
+    detect() call; models are exported with dynamic axes) like the
+    ultralytics predictor; the raw (batch, 4 + classes, anchors) output is filtered to
+    class 0 above the confidence threshold and reduced with NMS.
+    """
+    
+    def __init__(self, model_path, input_size=DETECTOR_INPUT_SIZE):
+        self.model_path = model_path
+        self.input_size = input_size
+    
+    def _letterbox(self, image, input_size):
+        height, width = image.shape[:2]
+        ratio = min(input_size / height, input_size / width)
+        new_width, new_height = int(round(width * ratio)), int(round(height * ratio))
+        pad_x = (input_size - new_width) / 2
+        pad_y = (input_size - new_height) / 2
+        
+        if (new_width, new_height) != (width, height):
+            image = cv2.resize(image, (new_width, new_height), interpolation=cv2.INTER_LINEAR)
+        top, bottom = int(round(pad_y - 0.1)), int(round(pad_y + 0.1))
+        left, right = int(round(pad_x - 0.1)), int(round(pad_x + 0.1))
+        image = cv2.copyMakeBorder(image, top, bottom, left, right, cv2.BORDER_CONSTANT, value=(114, 114, 114))
+        return image, ratio, (left, top)
+    
+    def preprocess(self, images, input_size=None):
+        """BGR images -> (N, 3, S, S) float32 RGB tensor and per-image (ratio, padding, shape)"""
+        input_size = input_size or self.input_size
+        batch = np.empty((len(images), 3, input_size, input_size), dtype=np.float32)
+        transforms = []
+        for i, image in enumerate(images):
+            padded, ratio, padding = self._letterbox(image, input_size)
+            batch[i] = padded[:, :, ::-1].transpose(2, 0, 1)
+            transforms.append((ratio, padding, image.shape[:2]))
+        batch *= 1 / 255.0
+        return batch, transforms
+    
+    def postprocess(self, output, transforms, confidence):
+        detections = []
+        for prediction, (ratio, (pad_x, pad_y), (height, width)) in zip(output, transforms):
+            scores = prediction[4]
+            keep = scores > confidence
+            if not keep.any():
+                detections.append([])
+                continue
+            
+            cx, cy, w, h = prediction[:4, keep]
+            scores = scores[keep]
+            x1 = (cx - w / 2 - pad_x) / ratio
+            y1 = (cy - h / 2 - pad_y) / ratio
+            boxes = np.stack([x1, y1, w / ratio, h / ratio], axis=1)
+            
+            indices = cv2.dnn.NMSBoxes(boxes.tolist(), scores.tolist(), confidence, DETECTOR_NMS_IOU)
+            # Clip to the image like the ultralytics predictor does
+            xyxy = np.hstack([boxes[:, :2], boxes[:, :2] + boxes[:, 2:]])
+            xyxy[:, [0, 2]] = xyxy[:, [0, 2]].clip(0, width)
+            xyxy[:, [1, 3]] = xyxy[:, [1, 3]].clip(0, height)
+            frame_detections = []
+            for index in sorted(np.array(indices).reshape(-1).tolist(), key=lambda i: -scores[i]):
+                frame_detections.append((*xyxy[index].tolist(), float(scores[index])))
+            detections.append(frame_detections)
+        return detections
+    
+    def detect(self, images, confidence=CONFIDENCE_THRESHOLD, input_size=None):
+        """Person boxes per image as lists of (x1, y1, x2, y2, confidence) in image pixels"""
+        batch, transforms = self.preprocess(images, input_size)
+        return self.postprocess(self.infer(batch), transforms, confidence)
+
+class OnnxRuntimeDetector(OnnxDetector):
+    """ONNX model on the ONNX Runtime CPU execution provider"""
+    
+    name = 'onnxruntime'
+    
+    def __init__(self, model_path, input_size=DETECTOR_INPUT_SIZE, threads=DETECTOR_THREADS):
+        super().__init__(model_path, input_size)
+        ort = importlib.import_module('onnxruntime')
+        options = ort.SessionOptions()
+        options.graph_optimization_level = ort.GraphOptimizationLevel.ORT_ENABLE_ALL
+        if threads:
+            options.intra_op_num_threads = threads
+        options.inter_op_num_threads = 1
+        self.session = ort.InferenceSession(str(model_path), options, providers=['CPUExecutionProvider'])
+        self.input_name = self.session.get_inputs()[0].name
+    
+    def infer(self, batch):
+        return self.session.run(None, {self.input_name: batch})[0]
+
+class OpenVinoDetector(OnnxDetector):
+    """ONNX model compiled for the OpenVINO CPU plugin"""
+    
+    name = 'openvino'
+    
+    def __init__(self, model_path, input_size=DETECTOR_INPUT_SIZE, threads=DETECTOR_THREADS):
+        super().__init__(model_path, input_size)
+        core = importlib.import_module('openvino').Core()
+        config = {'PERFORMANCE_HINT': 'LATENCY'}
+        if threads:
+            config['INFERENCE_NUM_THREADS'] = threads
+        self.model = core.compile_model(str(model_path), 'CPU', config)
+        self.output = self.model.output(0)
+    
+    def infer(self, batch):
+        return self.model(batch)[self.output]
+
+def export_onnx(weights=YOLO_WEIGHTS, input_size=DETECTOR_INPUT_SIZE):
+    """Export the YOLO weights to ONNX once; later calls reuse the file"""
+    weights = Path(weights)
+    onnx_path = weights.with_name(f"{weights.stem}_{input_size}.onnx")
+    if onnx_path.exists() and (not weights.exists() or onnx_path.stat().st_mtime >= weights.stat().st_mtime):
+        return onnx_path
+    
+    print(f"[AI] Exporting {weights} to ONNX ({input_size}px)...")
+    model = importlib.import_module('ultralytics').YOLO(str(weights))
+    # Dynamic axes so inference workers can send batches
+    exported = model.export(format='onnx', imgsz=input_size, dynamic=True)
+    os.replace(exported, onnx_path)
+    return onnx_path
+
+def quantize_onnx(onnx_path):
+    """INT8 weight-quantized copy of an ONNX model, created once"""
+    onnx_path = Path(onnx_path)
+    int8_path = onnx_path.with_name(f"{onnx_path.stem}_int8.onnx")
+    if int8_path.exists() and int8_path.stat().st_mtime >= onnx_path.stat().st_mtime:
+        return int8_path
+    
+    print(f"[AI] Quantizing {onnx_path} to INT8...")
+    quantization = importlib.import_module('onnxruntime.quantization')
+    quantization.quantize_dynamic(str(onnx_path), str(int8_path), weight_type=quantization.QuantType.QUInt8)
+    return int8_path
+
+DETECTOR_BACKENDS = {
+    'ultralytics': UltralyticsDetector,
+    'onnxruntime': OnnxRuntimeDetector,
+    'openvino': OpenVinoDetector,
+}
+
+def detector_model_path(backend=DETECTOR_BACKEND, int8=DETECTOR_INT8):
+    """ONNX model file for an ONNX backend, exported/quantized if needed; None for ultralytics"""
+    if backend not in DETECTOR_BACKENDS:
+        raise ValueError(f"Unknown DETECTOR_BACKEND '{backend}', expected one of {', '.join(DETECTOR_BACKENDS)}")
+    
+    if backend == 'ultralytics':
+        return None
+    
+    model_path = export_onnx()
+    if int8:
+        model_path = quantize_onnx(model_path)
+    return model_path
+
+def create_detector(backend=DETECTOR_BACKEND, int8=DETECTOR_INT8, model_path=None):
+    """Build the configured person detector, exporting the model first unless model_path is given"""
+    if model_path is None:
+        model_path = detector_model_path(backend, int8)
+    
+    if backend == 'ultralytics':
+        return UltralyticsDetector()
+    return DETECTOR_BACKENDS[backend](model_path)
+
+# ============== AI DETECTION ==============
+# Populated by ModelLoader; nothing heavy is loaded at import time
+person_detector = None
+face_recognition = None
+# The ultralytics predictor is not thread-safe; inference workers share the detector
+yolo_lock = threading.Lock()
+
+face_cache = FaceEncodingCache(KNOWN_FACES_DIR)
+face_index = FaceIndex()
+
+class ModelLoader:
+    """Load the YOLO model and known faces once, on demand or in the background.
+    
+    state moves from 'not_loaded' to 'loading' to 'ready' (or 'failed');
+    the time spent in each phase is logged and kept for /api/stats.
+    """
+    
+    def __init__(self):
+        self.state = 'not_loaded'
+        self.error = None
+        self.timings = {}
+        self.lock = threading.Lock()
+        self.ready = threading.Event()
+        # In process mode YOLO lives in the inference processes and the known
+        # faces in the main process
+        self.load_detector = INFERENCE_MODE != 'process'
+        self.load_known_faces = True
+        # Model file prepared by the parent of an inference process
+        self.detector_model_path = None
+    
+    def _phase(self, name, func):
+        start_time = time.perf_counter()
+        result = func()
+        self.timings[name] = round(time.perf_counter() - start_time, 3)
+        print(f"[Startup] {name}: {self.timings[name]:.2f}s")
+        return result
+    
+    def load(self):
+        """Load everything if needed; blocks until the models are ready"""
+        global person_detector, face_recognition
+        
+        with self.lock:
+            if self.state == 'ready':
+                return
+            
+            self.state = 'loading'
+            try:
+                if self.load_detector:
+                    # YOLOv8n (nano version for CPU) on the configured backend
+                    person_detector = self._phase(f'load detector ({DETECTOR_BACKEND})',
+                                                  lambda: create_detector(model_path=self.detector_model_path))
+                face_recognition = self._phase('import face_recognition', lambda: importlib.import_module('face_recognition'))
+                if self.load_known_faces:
+                    self._phase('load known faces', lambda: face_index.replace(*load_known_faces()))
+            except Exception as e:
+                self.state = 'failed'
+                self.error = str(e)
+                print(f"[Startup] Model loading failed: {e}")
+                raise
+            
+            self.state = 'ready'
+            self.ready.set()
+            print(f"[Startup] Models ready ({len(face_index)} known faces)")
+    
+    def start_background(self):
+        """Warm up the models on a background thread"""
+        def run():
+            try:
+                self.load()
+            except Exception:
+                pass
+        
+        threading.Thread(target=run, name="model-loader", daemon=True).start()
+    
+    def status(self):
+        return {'state': self.state, 'error': self.error, 'timings': dict(self.timings)}
+
+models = ModelLoader()
+
+# ============== FRAME SOURCES ==============
+class FrameSource:
+    """Something FrameGrabber can read BGR frames from.
+    
+    read(frame) returns (ok, frame) like cv2.VideoCapture.read(frame): a
+    buffer of the right size passed in may be filled in place instead of
+    allocating a new array. Sources that are not live streams pace
+    themselves to their fps so they behave like a camera.
+    """
+    
+    fps = 0
+    
+    def open(self):
+        return True
+    
+    def read(self, frame=None):
+        raise NotImplementedError
+    
+    def release(self):
+        pass
+    
+    def _pace(self):
+        """Sleep until the next frame is due at self.fps"""
+        if not self.fps:
+            return
+        now = time.monotonic()
+        next_time = getattr(self, '_next_frame_time', now)
+        if next_time > now:
+            time.sleep(next_time - now)
+        # Never try to catch up after falling behind by more than a frame
+        self._next_frame_time = max(next_time, now - 1 / self.fps) + 1 / self.fps
+
+class FfmpegCaptureOptions:
+    """Share the process-wide OPENCV_FFMPEG_CAPTURE_OPTIONS between opens.
+    
+    The variable is read while a capture opens. Opens with the same
+    options run concurrently; one with different options waits until the
+    opens in flight have finished. The lock is only held to set the
+    variable, never during an open, so a dead camera does not block others.
+    """
+    
+    def __init__(self):
+        self.condition = threading.Condition()
+        self.current = None
+        self.opening = 0
+    
+    def acquire(self, options):
+        with self.condition:
+            self.condition.wait_for(lambda: self.opening == 0 or self.current == options)
+            if self.current != options:
+                os.environ['OPENCV_FFMPEG_CAPTURE_OPTIONS'] = options
+                self.current = options
+            self.opening += 1
+    
+    def release(self):
+        with self.condition:
+            self.opening -= 1
+            self.condition.notify_all()
+
+ffmpeg_capture_options = FfmpegCaptureOptions()
+
+class VideoSource(FrameSource):
+    """RTSP/HTTP stream or video file read through cv2.VideoCapture"""
+    
+    def __init__(self, url, fps=None, loop=False, transport=None, buffer_size=None):
+        self.url = url
+        self.is_file = Path(url).is_file()
+        self.loop = loop
+        self.requested_fps = fps
+        self.transport = transport or CAPTURE_TRANSPORT
+        self.buffer_size = CAPTURE_FFMPEG_BUFFER_SIZE if buffer_size is None else buffer_size
+        self.cap = None
+    
+    def open(self):
+        if self.is_file:
+            self.cap = cv2.VideoCapture(self.url)
+        else:
+            options = [f'rtsp_transport;{self.transport}']
+            if self.buffer_size:
+                options.append(f'buffer_size;{self.buffer_size}')
+            
+            # Bounded open and read so a dead camera cannot hang the capture thread
+            ffmpeg_capture_options.acquire('|'.join(options))
+            try:
+                self.cap = cv2.VideoCapture(self.url, cv2.CAP_FFMPEG, [
+                    cv2.CAP_PROP_OPEN_TIMEOUT_MSEC, CAPTURE_OPEN_TIMEOUT_MS,
+                    cv2.CAP_PROP_READ_TIMEOUT_MSEC, CAPTURE_READ_TIMEOUT_MS,
+                ])
+            finally:
+                ffmpeg_capture_options.release()
+        
+        if not self.cap.isOpened():
+            return False
+        
+        if self.is_file:
+            # Replay files in real time, at their own frame rate unless overridden
+            self.fps = self.requested_fps or self.cap.get(cv2.CAP_PROP_FPS) or 25
+        else:
+            # Keep the backend's own queue as short as possible
+            self.cap.set(cv2.CAP_PROP_BUFFERSIZE, 1)
+        return True
+    
+    def read(self, frame=None):
+        self._pace()
+        ret, frame = self.cap.read(frame)
+        if not ret and self.is_file and self.loop:
+            self.cap.set(cv2.CAP_PROP_POS_FRAMES, 0)
+            ret, frame = self.cap.read(frame)
+        return ret, frame
+    
+    def release(self):
+        if self.cap:
+            self.cap.release()
+
+class ImageDirectorySource(FrameSource):
+    """Replay the JPEG/PNG images of a directory in name order"""
+    
+    EXTENSIONS = {'.jpg', '.jpeg', '.png'}
+    
+    def __init__(self, directory, fps=10, loop=True):
+        self.directory = Path(directory)
+        self.fps = fps
+        self.loop = loop
+        self.paths = []
+        self.index = 0
+    
+    def open(self):
+        self.paths = sorted(p for p in self.directory.iterdir() if p.suffix.lower() in self.EXTENSIONS)
+        self.index = 0
+        return bool(self.paths)
+    
+    def read(self, frame=None):
+        self._pace()
+        if self.index >= len(self.paths):
+            if not self.loop:
+                return False, None
+            self.index = 0
+        path = self.paths[self.index]
+        self.index += 1
+        frame = cv2.imread(str(path))
+        return frame is not None, frame
+
+class SyntheticSource(FrameSource):
+    """Generated frames: a static background with a moving block and a frame counter"""
+    
+    def __init__(self, width=1280, height=720, fps=15, seed=0):
+        self.width = width
+        self.height = height
+        self.fps = fps
+        self.seed = seed
+        self.background = None
+        self.frame_number = 0
+    
+    def open(self):
+        rng = np.random.default_rng(self.seed)
+        gradient = np.linspace(40, 160, self.width, dtype=np.uint8)
+        self.background = np.repeat(np.tile(gradient, (self.height, 1))[:, :, None], 3, axis=2)
+        self.background += rng.integers(0, 20, self.background.shape, dtype=np.uint8)
+        self.frame_number = 0
+        return True
+    
+    def read(self, frame=None):
+        self._pace()
+        if frame is None or frame.shape != self.background.shape:
+            frame = np.empty_like(self.background)
+        np.copyto(frame, self.background)
+        
+        # Block crossing the frame every 10 seconds, roughly person-sized
+        block_width, block_height = self.width // 8, self.height // 2
+        period = max(1, int((self.fps or 15) * 10))
+        x = int((self.frame_number % period) / period * (self.width - block_width))
+        y = self.height // 3
+        cv2.rectangle(frame, (x, y), (x + block_width, y + block_height), (30, 30, 200), -1)
+        cv2.putText(frame, str(self.frame_number), (10, 30), cv2.FONT_HERSHEY_SIMPLEX, 1, (255, 255, 255), 2)
+        
+        self.frame_number += 1
+        return True, frame
+
+def open_frame_source(url, transport=None, buffer_size=None):
+    """Build a FrameSource from a camera 'url'.
+    
+    rtsp://, http:// and other stream URLs go to cv2.VideoCapture, using the
+    given RTSP transport ('tcp' or 'udp') and FFmpeg buffer size. A video
+    file or a directory of images is replayed in real time (append ?fps=N or
+    ?loop=0 to change that), and synthetic://?width=W&height=H&fps=N
+    generates frames without any input.
+    """
+    parsed = urlparse(url)
+    params = {key: values[-1] for key, values in parse_qs(parsed.query).items()}
+    fps = float(params['fps']) if 'fps' in params else None
+    loop = params.get('loop', '1') != '0'
+    
+    if parsed.scheme == 'synthetic':
+        return SyntheticSource(int(params.get('width', 1280)), int(params.get('height', 720)),
+                               fps or 15, int(params.get('seed', 0)))
+    
+    if parsed.scheme in ('', 'file'):
+        path = parsed.path
+        if Path(path).is_dir():
+            return ImageDirectorySource(path, fps or 10, loop)
+        if Path(path).is_file():
+            return VideoSource(path, fps, loop)
+    
+    return VideoSource(url, transport=transport, buffer_size=buffer_size)
+
+# ============== FRAME CAPTURE ==============
+class FramePool:
+    """Reusable frame buffers for one camera.
+    
+    The same decoded frame is shared by the ring buffer, the live stream,
+    clip sampling, detection and photo saving, so it is handed out
+    read-only and never copied. A buffer is reused once nothing but the
+    pool refers to it; Python's reference count is the reference count, and
+    views keep their base buffer alive too, so consumers simply drop their
+    frames. When every buffer is still in use the pool grows up to
+    max_buffers and then hands out one-off arrays.
+    """
+    
+    def __init__(self, max_buffers=FRAME_POOL_SIZE):
+        self.max_buffers = max_buffers
+        self.buffers = []
+        self.shape = None
+        self.lock = threading.Lock()
+        self.allocations = 0
+        self.allocated_bytes = 0
+        self.reuses = 0
+        self.started_at = time.monotonic()
+        # References to an idle buffer seen from inside acquire(): the list,
+        # the loop variable and getrefcount's own argument
+        for probe in [np.empty(0)]:
+            self.idle_references = sys.getrefcount(probe)
+    
+    def acquire(self):
+        """A writable buffer for the next frame, or None while the frame size is unknown"""
+        with self.lock:
+            if self.shape is None:
+                return None
+            
+            for buffer in self.buffers:
+                if sys.getrefcount(buffer) == self.idle_references:
+                    if buffer.shape == self.shape:
+                        self.reuses += 1
+                        buffer.flags.writeable = True
+                        return buffer
+            
+            # Buffers of an old resolution are not coming back into use
+            self.buffers = [buffer for buffer in self.buffers if buffer.shape == self.shape]
+            
+            buffer = np.empty(self.shape, dtype=np.uint8)
+            self._count(buffer)
+            if len(self.buffers) < self.max_buffers:
+                self.buffers.append(buffer)
+            return buffer
+    
+    def adopt(self, frame, buffer):
+        """Publish a decoded frame read-only; buffer is what acquire() gave the source"""
+        if frame is not buffer:
+            # The source allocated (first frame, new resolution or no in-place decoding)
+            with self.lock:
+                self._count(frame)
+                self.shape = frame.shape
+        frame.flags.writeable = False
+        return frame
+    
+    def _count(self, array):
+        self.allocations += 1
+        self.allocated_bytes += array.nbytes
+    
+    def stats(self):
+        with self.lock:
+            elapsed = max(time.monotonic() - self.started_at, 1e-9)
+            in_use = sum(sys.getrefcount(buffer) > self.idle_references for buffer in self.buffers)
+            return {
+                'buffers': len(self.buffers),
+                'in_use': in_use,
+                'reuses': self.reuses,
+                'allocations': self.allocations,
+                'allocated_bytes': self.allocated_bytes,
+                'allocated_mb': round(self.allocated_bytes / 1024 / 1024, 1),
+                'allocations_per_s': round(self.allocations / elapsed, 3),
+                'allocated_mb_per_s': round(self.allocated_bytes / 1024 / 1024 / elapsed, 3),
+            }
+
+class FrameGrabber:
+    """Drain a video stream on its own thread into a small ring buffer.
+
+    The capture thread reads at camera FPS so the decoder and the RTSP socket
+    never back up while inference is busy. Consumers always receive the
+    freshest frame; anything older still sitting in the buffer is dropped.
+    
+    A supervisor thread owns the connection. It reconnects with exponential
+    backoff (CAPTURE_RECONNECT_MIN..MAX seconds) when the stream cannot be
+    opened, after CAPTURE_MAX_READ_FAILURES failed reads in a row, or when no
+    frame has arrived for CAPTURE_STALL_TIMEOUT seconds. A stalled reader
+    thread is abandoned rather than released from another thread; it exits
+    and releases its own capture when its read returns.
+    """
+    
+    def __init__(self, source, buffer_size=CAPTURE_BUFFER_SIZE, on_frame=None, name='camera', source_options=None):
+        # A camera URL, opened afresh on every connect, or a FrameSource
+        # instance that is reopened
+        self.source = source
+        self.source_options = source_options or {}
+        self.name = name
+        self.buffer = deque(maxlen=max(1, buffer_size))
+        self.condition = threading.Condition()
+        self.on_frame = on_frame
+        self.pool = FramePool()
+        self.latest_frame = None
+        self.frames_decoded = 0
+        self.frames_dropped = 0
+        self.read_failures = 0
+        self.last_frame_time = None
+        # Smoothed seconds between decoded frames
+        self.frame_interval = None
+        self.running = False
+        self.thread = None
+        # Connection state, owned by the supervisor thread
+        self.wakeup = threading.Event()
+        self.generation = 0
+        self.reader = None
+        self.reader_failed = False
+        self.connected_at = None
+        self.connects = 0
+        self.connect_failures = 0
+        self.stalls = 0
+        self.started_at = None
+        self.connected_seconds = 0.0
+        self.last_error = None
+    
+    def start(self):
+        """Start the capture supervisor, which connects (and keeps retrying) in the background"""
+        self.running = True
+        self.started_at = time.monotonic()
+        self.thread = threading.Thread(target=self._supervise, name=f"capture-{self.name}", daemon=True)
+        self.thread.start()
+    
+    def stop(self):
+        """Stop the capture threads; readers release their streams as they exit"""
+        self.running = False
+        self.wakeup.set()
+        with self.condition:
+            self.condition.notify_all()
+        if self.thread:
+            self.thread.join(timeout=5)
+        self._disconnect(None)
+    
+    def _new_source(self):
+        if isinstance(self.source, str):
+            return open_frame_source(self.source, **self.source_options)
+        return self.source
+    
+    def _connect(self):
+        source = self._new_source()
+        try:
+            opened = source.open()
+        except Exception as e:
+            opened = False
+            self.last_error = str(e)
+        
+        if not opened:
+            source.release()
+            self.connect_failures += 1
+            return False
+        
+        self.connects += 1
+        self.generation += 1
+        self.reader_failed = False
+        self.connected_at = time.monotonic()
+        self.reader = threading.Thread(target=self._read_loop, args=(source, self.generation),
+                                       name=f"reader-{self.name}", daemon=True)
+        self.reader.start()
+        
+        print(f"[Capture] {self.name}: {'reconnected' if self.connects > 1 else 'connected'}")
+        return True
+    
+    def _disconnect(self, reason):
+        if self.connected_at is None:
+            return
+        # The reader notices the new generation and releases its capture
+        self.generation += 1
+        self.connected_seconds += time.monotonic() - self.connected_at
+        self.connected_at = None
+        if reason:
+            self.last_error = reason
+            print(f"[Capture] {self.name}: {reason}, reconnecting")
+    
+    def _supervise(self):
+        backoff = CAPTURE_RECONNECT_MIN
+        
+        while self.running:
+            if self.connected_at is None:
+                # A shared source instance can only be reopened once its old reader is gone
+                if not isinstance(self.source, str) and self.reader and self.reader.is_alive():
+                    self.wakeup.wait(0.5)
+                    self.wakeup.clear()
+                    continue
+                
+                if self._connect():
+                    backoff = CAPTURE_RECONNECT_MIN
+                    continue
+                
+                print(f"[Capture] {self.name}: cannot open stream, retrying in {backoff:g}s")
+                self.wakeup.wait(backoff)
+                self.wakeup.clear()
+                backoff = min(backoff * 2, CAPTURE_RECONNECT_MAX)
+                continue
+            
+            self.wakeup.wait(1)
+            self.wakeup.clear()
+            if not self.running:
+                break
+            
+            # Stall: no frame since the last one (or since connecting) for too long
+            last_activity = max(self.last_frame_time or 0, self.connected_at or 0)
+            if self.reader_failed:
+                self._disconnect(f"{CAPTURE_MAX_READ_FAILURES} failed reads")
+            elif time.monotonic() - last_activity > CAPTURE_STALL_TIMEOUT:
+                self.stalls += 1
+                self._disconnect(f"no frame for {CAPTURE_STALL_TIMEOUT:g}s")
+    
+    def _read_loop(self, source, generation):
+        failures = 0
+        
+        while self.running and generation == self.generation:
+            buffer = self.pool.acquire()
+            ret, frame = source.read(buffer)
+            
+            if generation != self.generation:
+                break
+            
+            if not ret:
+                self.read_failures += 1
+                failures += 1
+                if failures >= CAPTURE_MAX_READ_FAILURES:
+                    self.reader_failed = True
+                    self.wakeup.set()
+                    break
+                time.sleep(0.05)
+                continue
+            
+            failures = 0
+            self._publish(self.pool.adopt(frame, buffer))
+        
+        source.release()
+    
+    def _publish(self, frame):
+        now = time.monotonic()
+        connected_at = self.connected_at
+        # Intervals spanning a reconnect would skew the frame rate
+        if self.last_frame_time is not None and connected_at is not None and self.last_frame_time >= connected_at:
+            interval = now - self.last_frame_time
+            if self.frame_interval is None:
+                self.frame_interval = interval
+            else:
+                self.frame_interval += (interval - self.frame_interval) * 0.1
+        self.last_frame_time = now
+        
+        with self.condition:
+            # A full ring buffer overwrites its oldest frame
+            if len(self.buffer) == self.buffer.maxlen:
+                self.frames_dropped += 1
+            self.frames_decoded += 1
+            self.buffer.append((self.frames_decoded, frame))
+            # Latest frame for web streaming and clips; frames are read-only
+            # and their buffer is only reused once nobody holds it
+            self.latest_frame = frame
+            self.condition.notify_all()
+        
+        if self.on_frame:
+            self.on_frame()
+    
+    def read_latest(self, min_sequence=0, timeout=None):
+        """Return (sequence, frame) for the freshest frame.
+        
+        Waits until a frame with sequence >= min_sequence is available and
+        discards every older frame still in the buffer. Returns (None, None)
+        on timeout or when the grabber is stopped.
+        """
+        def ready():
+            return not self.running or (self.buffer and self.buffer[-1][0] >= min_sequence)
+        
+        with self.condition:
+            if not self.condition.wait_for(ready, timeout) or not self.buffer:
+                return None, None
+            
+            sequence, frame = self.buffer.pop()
+            if sequence < min_sequence:
+                self.buffer.append((sequence, frame))
+                return None, None
+            
+            self.frames_dropped += len(self.buffer)
+            self.buffer.clear()
+            return sequence, frame
+    
+    def peek_latest(self, after_sequence=0, timeout=None):
+        """Return (sequence, frame) of the newest frame without consuming it.
+        
+        Waits for a frame newer than after_sequence; returns (None, None) on
+        timeout. Only the reference is taken under the lock.
+        """
+        with self.condition:
+            if not self.condition.wait_for(lambda: self.frames_decoded > after_sequence, timeout):
+                return None, None
+            return self.frames_decoded, self.latest_frame
+    
+    def stats(self):
+        """Capture counters for monitoring"""
+        with self.condition:
+            return {
+                'frames_decoded': self.frames_decoded,
+                'frames_dropped': self.frames_dropped,
+                'read_failures': self.read_failures,
+                'buffered': len(self.buffer),
+                'fps': round(1 / self.frame_interval, 2) if self.frame_interval and self.connected else 0.0,
+                'connected': self.connected,
+                'uptime_s': round(self.uptime, 1),
+                'availability': round(self.availability, 4),
+                'reconnects': max(0, self.connects - 1),
+                'connect_failures': self.connect_failures,
+                'stalls': self.stalls,
+                'last_error': self.last_error,
+                'frame_pool': self.pool.stats(),
+            }
+    
+    @property
+    def connected(self):
+        return self.connected_at is not None
+    
+    @property
+    def uptime(self):
+        """Seconds since the current connection was made"""
+        connected_at = self.connected_at
+        return time.monotonic() - connected_at if connected_at is not None else 0.0
+    
+    @property
+    def availability(self):
+        """Share of the time since start() the stream was connected"""
+        if self.started_at is None:
+            return 0.0
+        elapsed = time.monotonic() - self.started_at
+        return (self.connected_seconds + self.uptime) / elapsed if elapsed > 0 else 1.0
+
+# ============== LIVE STREAM ==============
+_placeholder_jpeg = None
+
+def placeholder_jpeg():
+    """JPEG shown while a camera has no frame yet, encoded only once"""
+    global _placeholder_jpeg
+    if _placeholder_jpeg is None:
+        placeholder = np.zeros((480, 640, 3), dtype=np.uint8)
+        ret, buffer = cv2.imencode('.jpg', placeholder)
+        _placeholder_jpeg = buffer.tobytes()
+    return _placeholder_jpeg
+
+def mjpeg_part(jpeg):
+    return (b'--frame\r\n'
+            b'Content-Type: image/jpeg\r\n\r\n' + jpeg + b'\r\n')
+
+class StreamBroadcaster:
+    """Encode each new camera frame to JPEG once and share it with all viewers.
+    
+    A single encoder thread runs while at least one /stream client is
+    connected, resizing to STREAM_WIDTH and encoding at STREAM_JPEG_QUALITY
+    at most STREAM_MAX_FPS times a second. Clients always pick up the newest
+    encoded frame, so a slow connection simply skips frames.
+    """
+    
+    def __init__(self, grabber):
+        self.grabber = grabber
+        self.condition = threading.Condition()
+        self.jpeg = None
+        self.sequence = 0
+        self.clients = 0
+        self.frames_encoded = 0
+        self.thread = None
+    
+    def _encode(self, frame):
+        height, width = frame.shape[:2]
+        if STREAM_WIDTH and width > STREAM_WIDTH:
+            frame = cv2.resize(frame, (STREAM_WIDTH, int(height * STREAM_WIDTH / width)),
+                               interpolation=cv2.INTER_AREA)
+        ret, buffer = cv2.imencode('.jpg', frame, [cv2.IMWRITE_JPEG_QUALITY, STREAM_JPEG_QUALITY])
+        return buffer.tobytes() if ret else None
+    
+    def _run(self):
+        last_sequence = 0
+        min_interval = 1 / STREAM_MAX_FPS if STREAM_MAX_FPS > 0 else 0
+        
+        while True:
+            with self.condition:
+                # Idle while nobody is watching
+                self.condition.wait_for(lambda: self.clients > 0)
+            
+            sequence, frame = self.grabber.peek_latest(last_sequence, timeout=1)
+            if frame is None:
+                continue
+            
+            start_time = time.monotonic()
+            jpeg = self._encode(frame)
+            last_sequence = sequence
+            
+            if jpeg:
+                with self.condition:
+                    self.jpeg = jpeg
+                    self.sequence += 1
+                    self.frames_encoded += 1
+                    self.condition.notify_all()
+            
+            elapsed = time.monotonic() - start_time
+            if elapsed < min_interval:
+                time.sleep(min_interval - elapsed)
+    
+    def frames(self):
+        """Multipart MJPEG generator for one client"""
+        with self.condition:
+            self.clients += 1
+            if self.thread is None:
+                self.thread = threading.Thread(target=self._run, name="stream-encoder", daemon=True)
+                self.thread.start()
+            self.condition.notify_all()
+        
+        last_sequence = -1
+        try:
+            while True:
+                with self.condition:
+                    # Re-send periodically so idle connections stay alive
+                    self.condition.wait_for(lambda: self.sequence != last_sequence, timeout=5)
+                    jpeg, last_sequence = self.jpeg, self.sequence
+                yield mjpeg_part(jpeg or placeholder_jpeg())
+        finally:
+            with self.condition:
+                self.clients -= 1
+    
+    def stats(self):
+        with self.condition:
+            return {'clients': self.clients, 'frames_encoded': self.frames_encoded}
+
+# ============== EVENT CLIPS ==============
+FFMPEG_PATH = shutil.which('ffmpeg')
+
+# One clip is encoded at a time, never on an inference thread
+clip_pool = ThreadPoolExecutor(max_workers=1, thread_name_prefix='clip-encoder')
+
+def write_clip_file(path, jpegs, fps):
+    """Write JPEG frames as a video file.
+    
+    With ffmpeg the JPEGs are either stream-copied (CLIP_CODEC=copy, MJPEG
+    in AVI) or encoded once to H.264 MP4 that browsers can play; without it
+    OpenCV's MPEG-4 writer is used.
+    """
+    path = Path(path)
+    tmp_path = path.with_suffix('.part' + path.suffix)
+    
+    if FFMPEG_PATH:
+        if CLIP_CODEC == 'copy':
+            codec = ['-c:v', 'copy']
+        else:
+            codec = ['-c:v', 'libx264', '-preset', 'veryfast', '-pix_fmt', 'yuv420p', '-movflags', '+faststart']
+        subprocess.run(
+            [FFMPEG_PATH, '-y', '-loglevel', 'error', '-f', 'image2pipe', '-framerate', f'{fps:.3f}',
+             '-c:v', 'mjpeg', '-i', '-', *codec, str(tmp_path)],
+            input=b''.join(jpegs), capture_output=True, timeout=300, check=True
+        )
     else:
-        cursor.execute('''
-            SELECT * FROM detections 
-            ORDER BY timestamp DESC 
-            LIMIT ?
-        ''', (limit,))
+        writer = None
+        try:
+            for jpeg in jpegs:
+                frame = cv2.imdecode(np.frombuffer(jpeg, dtype=np.uint8), cv2.IMREAD_COLOR)
+                if writer is None:
+                    height, width = frame.shape[:2]
+                    writer = cv2.VideoWriter(str(tmp_path), cv2.VideoWriter_fourcc(*'mp4v'), fps, (width, height))
+                writer.write(frame)
+        finally:
+            if writer is not None:
+                writer.release()
     
-    detections = cursor.fetchall()
-    conn.close()
-    return detections
+    os.replace(tmp_path, path)
+
+class ClipRecorder:
+    """Record a short clip around each detection from a rolling buffer of JPEGs.
+    
+    A sampler thread takes the newest camera frame CLIP_FPS times a second,
+    downscales it to CLIP_WIDTH and keeps the compressed frames of the last
+    CLIP_PRE_SECONDS (never more than CLIP_BUFFER_MAX_MB). A trigger starts a
+    clip from that pre-event footage and keeps adding frames until
+    CLIP_POST_SECONDS after the latest trigger, up to CLIP_MAX_SECONDS, so
+    overlapping detections share one clip. Finished clips are written on the
+    clip pool and linked to their detections through the detection writer.
+    """
+    
+    def __init__(self, camera):
+        self.camera = camera
+        self.lock = threading.Lock()
+        self.buffer = deque()
+        self.buffer_bytes = 0
+        self.active = None
+        self.running = False
+        self.thread = None
+        self.frames_sampled = 0
+        self.clips_written = 0
+        self.clip_errors = 0
+        self.write_latency = Histogram(LATENCY_BUCKETS_MS)
+    
+    def start(self):
+        self.running = True
+        self.thread = threading.Thread(target=self._run, name=f"clips-{self.camera.id}", daemon=True)
+        self.thread.start()
+    
+    def stop(self):
+        """Stop sampling and write the clip in progress"""
+        self.running = False
+        if self.thread:
+            self.thread.join(timeout=5)
+        with self.lock:
+            clip, self.active = self.active, None
+        if clip:
+            clip_pool.submit(self._write, clip)
+    
+    def trigger(self, timestamp):
+        """Record the detection with this timestamp in the current or a new clip"""
+        if not self.running:
+            return
+        
+        now = time.time()
+        with self.lock:
+            if self.active is None:
+                extension = '.avi' if FFMPEG_PATH and CLIP_CODEC == 'copy' else '.mp4'
+                self.active = {
+                    'path': CLIPS_DIR / f"clip_{int(now * 1000)}_{self.camera.id}{extension}",
+                    'frames': list(self.buffer),
+                    'started': now,
+                    'end_time': now + CLIP_POST_SECONDS,
+                    'timestamps': [],
+                }
+            else:
+                self.active['end_time'] = min(now + CLIP_POST_SECONDS, self.active['started'] + CLIP_MAX_SECONDS)
+            self.active['timestamps'].append(timestamp)
+    
+    def _encode(self, frame):
+        height, width = frame.shape[:2]
+        if CLIP_WIDTH and width > CLIP_WIDTH:
+            frame = cv2.resize(frame, (CLIP_WIDTH, int(height * CLIP_WIDTH / width)), interpolation=cv2.INTER_AREA)
+        ret, buffer = cv2.imencode('.jpg', frame, [cv2.IMWRITE_JPEG_QUALITY, CLIP_JPEG_QUALITY])
+        return buffer.tobytes() if ret else None
+    
+    def _run(self):
+        last_sequence = 0
+        interval = 1 / CLIP_FPS
+        max_bytes = CLIP_BUFFER_MAX_MB * 1024 * 1024
+        
+        while self.running:
+            start_time = time.monotonic()
+            sequence, frame = self.camera.grabber.peek_latest(last_sequence, timeout=interval)
+            
+            jpeg = None
+            if frame is not None:
+                last_sequence = sequence
+                jpeg = self._encode(frame)
+            
+            now = time.time()
+            finished = None
+            with self.lock:
+                if jpeg:
+                    self.frames_sampled += 1
+                    self.buffer.append((now, jpeg))
+                    self.buffer_bytes += len(jpeg)
+                    if self.active:
+                        self.active['frames'].append((now, jpeg))
+                
+                # Bounded by age and by size
+                while self.buffer and (now - self.buffer[0][0] > CLIP_PRE_SECONDS or self.buffer_bytes > max_bytes):
+                    self.buffer_bytes -= len(self.buffer.popleft()[1])
+                
+                if self.active and now >= self.active['end_time']:
+                    finished, self.active = self.active, None
+            
+            if finished:
+                clip_pool.submit(self._write, finished)
+            
+            elapsed = time.monotonic() - start_time
+            if elapsed < interval:
+                time.sleep(interval - elapsed)
+    
+    def _write(self, clip):
+        frames = clip['frames']
+        if len(frames) < 2:
+            return
+        
+        start_time = time.perf_counter()
+        # Frame rate actually sampled, so the clip plays back in real time
+        fps = (len(frames) - 1) / max(frames[-1][0] - frames[0][0], 1e-3)
+        try:
+            write_clip_file(clip['path'], [jpeg for _, jpeg in frames], fps)
+        except Exception as e:
+            self.clip_errors += 1
+            print(f"[Clips Error] {self.camera.name}: {e}")
+            return
+        
+        for timestamp in clip['timestamps']:
+            detection_writer.execute('UPDATE detections SET clip_path = ? WHERE timestamp = ? AND camera_name = ?',
+                                     (str(clip['path']), timestamp, self.camera.name))
+        self.clips_written += 1
+        self.write_latency.observe((time.perf_counter() - start_time) * 1000)
+    
+    def stats(self):
+        with self.lock:
+            return {
+                'buffered_frames': len(self.buffer),
+                'buffer_bytes': self.buffer_bytes,
+                'recording': self.active is not None,
+                'frames_sampled': self.frames_sampled,
+                'clips_written': self.clips_written,
+                'clip_errors': self.clip_errors,
+                'write_latency_ms': self.write_latency.snapshot(),
+            }
+
+# ============== MOTION DETECTION ==============
+def polygon_mask(polygons, width, height):
+    """Rasterize polygons given in normalized 0..1 coordinates into a uint8 mask"""
+    mask = np.zeros((height, width), dtype=np.uint8)
+    for polygon in polygons:
+        points = np.array([[x * width, y * height] for x, y in polygon], dtype=np.int32)
+        cv2.fillPoly(mask, [points], 255)
+    return mask
+
+class MotionDetector:
+    """Cheap motion pre-filter run before a frame is sent to YOLO.
+    
+    Frames are downscaled to MOTION_WIDTH grayscale and compared against a
+    running-average background. Optional per-camera regions restrict where
+    motion counts: 'motion_zones' (only these areas) and 'motion_ignore'
+    (never these areas, e.g. trees or the timestamp overlay), both lists
+    of polygons in normalized coordinates.
+    """
+    
+    def __init__(self, zones=None, ignore=None):
+        self.zones = zones or []
+        self.ignore = ignore or []
+        self.background = None
+        self.mask = None
+        self.mask_pixels = 0
+        self.last_motion = 0.0
+        self.frames_checked = 0
+        self.frames_skipped = 0
+        self.check_time = 0.0
+    
+    def _prepare(self, gray):
+        height, width = gray.shape
+        if self.zones or self.ignore:
+            self.mask = polygon_mask(self.zones, width, height) if self.zones else np.full((height, width), 255, np.uint8)
+            self.mask[polygon_mask(self.ignore, width, height) > 0] = 0
+            self.mask_pixels = max(cv2.countNonZero(self.mask), 1)
+        else:
+            self.mask_pixels = width * height
+        self.background = gray.astype(np.float32)
+    
+    def has_motion(self, frame):
+        """Update the background model and report whether the frame moved"""
+        start_time = time.perf_counter()
+        
+        height, width = frame.shape[:2]
+        small = cv2.resize(frame, (MOTION_WIDTH, max(1, int(height * MOTION_WIDTH / width))),
+                           interpolation=cv2.INTER_AREA)
+        gray = cv2.GaussianBlur(cv2.cvtColor(small, cv2.COLOR_BGR2GRAY), (5, 5), 0)
+        
+        if self.background is None or self.background.shape != gray.shape:
+            self._prepare(gray)
+            motion = True
+        else:
+            diff = cv2.absdiff(gray, cv2.convertScaleAbs(self.background))
+            cv2.accumulateWeighted(gray, self.background, MOTION_LEARNING_RATE)
+            _, changed = cv2.threshold(diff, MOTION_PIXEL_THRESHOLD, 255, cv2.THRESH_BINARY)
+            if self.mask is not None:
+                changed = cv2.bitwise_and(changed, self.mask)
+            motion = cv2.countNonZero(changed) / self.mask_pixels >= MOTION_MIN_AREA
+        
+        self.frames_checked += 1
+        self.check_time += time.perf_counter() - start_time
+        return motion
+    
+    def should_process(self, frame, active_tracks):
+        """Gate a frame: motion, a recent motion hold or tracked people let it through"""
+        now = time.time()
+        
+        if self.has_motion(frame):
+            self.last_motion = now
+        
+        if active_tracks or now - self.last_motion <= MOTION_HOLD:
+            return True
+        
+        self.frames_skipped += 1
+        return False
+    
+    def stats(self):
+        skipped_share = self.frames_skipped / self.frames_checked if self.frames_checked else 0.0
+        return {
+            'frames_checked': self.frames_checked,
+            'frames_skipped': self.frames_skipped,
+            'skipped_share': round(skipped_share, 4),
+            'motion_check_seconds': round(self.check_time, 3),
+            # Skipped frames times the measured per-frame inference cost
+            'estimated_cpu_seconds_saved': round(self.frames_skipped * estimated_frame_cost_ms() / 1000, 3),
+        }
+
+# ============== CAMERAS ==============
+def load_camera_config():
+    """Load camera list from CAMERAS_CONFIG, falling back to RTSP_URL/CAMERA_NAME"""
+    config_path = Path(CAMERAS_CONFIG)
+    
+    if config_path.exists():
+        with open(config_path) as f:
+            cameras = json.load(f)
+    elif RTSP_URL:
+        cameras = [{'name': CAMERA_NAME, 'url': RTSP_URL}]
+    else:
+        cameras = []
+    
+    seen_ids = set()
+    for camera in cameras:
+        if not camera.get('name') or not camera.get('url'):
+            raise ValueError(f"Camera entry needs 'name' and 'url': {camera}")
+        
+        # Short filesystem-safe id used in file names and API parameters
+        camera_id = camera.get('id') or re.sub(r'[^a-z0-9]+', '_', camera['name'].lower()).strip('_')
+        if camera_id in seen_ids:
+            raise ValueError(f"Duplicate camera id: {camera_id}")
+        seen_ids.add(camera_id)
+        camera['id'] = camera_id
+    
+    return cameras
+
+class CameraStream:
+    """Capture stage and detection state for a single camera"""
+    
+    def __init__(self, config, on_frame=None, source=None):
+        self.config = config
+        self.id = config['id']
+        self.name = config['name']
+        self.url = config['url']
+        self.grabber = FrameGrabber(source or self.url, on_frame=on_frame, name=self.name, source_options={
+            'transport': config.get('transport'),
+            'buffer_size': config.get('ffmpeg_buffer_size'),
+        })
+        self.broadcaster = StreamBroadcaster(self.grabber)
+        self.clips = ClipRecorder(self) if CLIP_RECORDING else None
+        self.last_sequence = 0
+        self.tracker = PersonTracker()
+        self.motion = MotionDetector(config.get('motion_zones'), config.get('motion_ignore'))
+        self.zones = DetectionZones(config.get('detection_zones'), config.get('detection_ignore'))
+        # Set while an inference worker owns this camera's current frame
+        self.busy = False
+        # When the rate governor lets this camera be analysed again
+        self.next_due = 0.0
+        # Capture time of the frame being analysed, for end-to-end latency
+        self.frame_time = None
+    
+    def should_process(self, frame):
+        """Skip static scenes unless people are currently being tracked"""
+        if not MOTION_GATING:
+            return True
+        return self.motion.should_process(frame, bool(self.tracker.tracks))
+
+class RateGovernor:
+    """Set each camera's analysis rate from a latency target and a CPU budget.
+    
+    A camera with motion or live tracks wants ANALYSIS_ACTIVE_FPS, an empty
+    scene ANALYSIS_IDLE_FPS. Every GOVERNOR_INTERVAL seconds a shared load
+    factor is cut when the smoothed end-to-end latency (frame captured to
+    frame handled) is above TARGET_LATENCY_MS or the pipeline uses more
+    than CPU_BUDGET percent of all cores, and raised again slowly while both
+    have headroom. Cameras run at their wanted rate times that factor, but
+    never below ANALYSIS_MIN_FPS.
+    """
+    
+    # Seconds of processed frames behind the effective rate
+    RATE_WINDOW = 10
+    
+    def __init__(self):
+        self.lock = threading.Lock()
+        self.factor = 1.0
+        self.latency = None
+        self.cpu_percent = 0.0
+        self.last_adjust = time.monotonic()
+        self.last_cpu = None
+        self.throttles = 0
+        # Camera id -> monotonic times of recently processed frames
+        self.processed = {}
+    
+    def wanted_fps(self, camera):
+        """Rate a camera asks for: active with motion or tracks, idle otherwise"""
+        # Without motion gating there is no motion signal; treat every scene as live
+        active = (not MOTION_GATING or camera.tracker.tracks
+                  or time.time() - camera.motion.last_motion <= MOTION_HOLD)
+        return ANALYSIS_ACTIVE_FPS if active else ANALYSIS_IDLE_FPS
+    
+    def interval(self, camera):
+        """Seconds until a camera's next frame is analysed"""
+        return 1 / max(ANALYSIS_MIN_FPS, self.wanted_fps(camera) * self.factor)
+    
+    def record(self, camera, latency):
+        """Account one processed frame and its end-to-end latency in seconds"""
+        now = time.monotonic()
+        with self.lock:
+            times = self.processed.setdefault(camera.id, deque())
+            times.append(now)
+            while now - times[0] > self.RATE_WINDOW:
+                times.popleft()
+            
+            if self.latency is None:
+                self.latency = latency
+            else:
+                self.latency += (latency - self.latency) * 0.2
+            
+            if now - self.last_adjust >= GOVERNOR_INTERVAL:
+                self._adjust(now)
+    
+    def _cpu_seconds(self):
+        times = os.times()
+        seconds = times.user + times.system
+        if isinstance(inference_pool, ProcessInferencePool):
+            seconds += inference_pool.cpu_seconds()
+        return seconds
+    
+    def _adjust(self, now):
+        cpu = self._cpu_seconds()
+        if self.last_cpu is not None:
+            elapsed = now - self.last_adjust
+            self.cpu_percent = max(0.0, cpu - self.last_cpu) / elapsed / (os.cpu_count() or 1) * 100
+        self.last_cpu = cpu
+        self.last_adjust = now
+        
+        latency_ms = self.latency * 1000
+        if latency_ms > TARGET_LATENCY_MS or self.cpu_percent > CPU_BUDGET:
+            # Back off fast, recover slowly
+            self.factor = max(0.05, self.factor * 0.7)
+            self.throttles += 1
+        elif latency_ms < TARGET_LATENCY_MS * 0.7 and self.cpu_percent < CPU_BUDGET * 0.85:
+            self.factor = min(1.0, self.factor * 1.15)
+    
+    def effective_fps(self, camera):
+        """Frames per second actually analysed over the last RATE_WINDOW seconds"""
+        now = time.monotonic()
+        with self.lock:
+            times = self.processed.get(camera.id, ())
+            return sum(now - t <= self.RATE_WINDOW for t in times) / self.RATE_WINDOW
+    
+    def stats(self, cameras):
+        per_camera = {camera.id: {
+            'wanted_fps': self.wanted_fps(camera),
+            'target_fps': round(1 / self.interval(camera), 2),
+            'effective_fps': round(self.effective_fps(camera), 2),
+        } for camera in cameras}
+        return {
+            'load_factor': round(self.factor, 3),
+            'latency_ms': round(self.latency * 1000, 1) if self.latency is not None else None,
+            'cpu_percent': round(self.cpu_percent, 1),
+            'throttles': self.throttles,
+            'cameras': per_camera,
+        }
+
+rate_governor = RateGovernor()
+
+class InferenceScheduler:
+    """Hand out fresh frames to inference workers, round-robin across cameras.
+    
+    A camera is only due again once rate_governor's interval for it has
+    passed, and then always gets its freshest frame.
+    """
+    
+    def __init__(self, cameras):
+        self.cameras = cameras
+        self.next_index = 0
+        self.condition = threading.Condition()
+    
+    def notify(self):
+        """Wake waiting workers; called by grabbers on every new frame"""
+        with self.condition:
+            self.condition.notify_all()
+    
+    def _take_next(self):
+        now = time.monotonic()
+        
+        for offset in range(len(self.cameras)):
+            index = (self.next_index + offset) % len(self.cameras)
+            camera = self.cameras[index]
+            
+            if camera.busy or now < camera.next_due:
+                continue
+            
+            # Always the freshest frame; older ones are dropped
+            sequence, frame = camera.grabber.read_latest(camera.last_sequence + 1, timeout=0)
+            
+            if frame is None:
+                continue
+            
+            camera.busy = True
+            camera.last_sequence = sequence
+            camera.frame_time = camera.grabber.last_frame_time
+            camera.next_due = now + rate_governor.interval(camera)
+            # Start the next search after this camera so no stream starves
+            self.next_index = (index + 1) % len(self.cameras)
+            return camera, frame
+        
+        return None, None
+    
+    def _wait_next(self, deadline):
+        with self.condition:
+            while True:
+                camera, frame = self._take_next()
+                if camera is not None:
+                    return camera, frame
+                
+                now = time.monotonic()
+                remaining = deadline - now if deadline is not None else None
+                if remaining is not None and remaining <= 0:
+                    return None, None
+                
+                # Wake for a new frame, the next camera falling due or the deadline
+                waits = [camera.next_due - now for camera in self.cameras
+                         if not camera.busy and camera.next_due > now]
+                if remaining is not None:
+                    waits.append(remaining)
+                self.condition.wait(min(waits) if waits else None)
+    
+    def next_job(self, timeout=None):
+        """Return (camera, frame) for the next camera due for inference"""
+        deadline = time.monotonic() + timeout if timeout is not None else None
+        
+        while True:
+            camera, frame = self._wait_next(deadline)
+            if camera is None:
+                return None, None
+            
+            # Motion gate runs outside the lock; the camera is already claimed
+            if camera.should_process(frame):
+                return camera, frame
+            self.done(camera, processed=False)
+    
+    def done(self, camera, processed=True):
+        """Release a camera after its frame has been processed (or skipped)"""
+        if processed and camera.frame_time is not None:
+            rate_governor.record(camera, time.monotonic() - camera.frame_time)
+        with self.condition:
+            camera.busy = False
+            self.condition.notify_all()
+
+class InferenceBatcher:
+    """Collect frames across cameras into batches for a single YOLO call.
+    
+    A batch closes when it holds YOLO_BATCH_SIZE frames or YOLO_BATCH_TIMEOUT_MS
+    after its first frame arrived. Person boxes are scattered back to the
+    worker pool together with their source camera and frame.
+    """
+    
+    def __init__(self, scheduler, batch_size=YOLO_BATCH_SIZE, timeout_ms=YOLO_BATCH_TIMEOUT_MS):
+        self.scheduler = scheduler
+        self.batch_size = max(1, batch_size)
+        self.timeout = timeout_ms / 1000
+        self.results = queue.Queue()
+        self.thread = None
+    
+    def start(self):
+        self.thread = threading.Thread(target=self._run, name="inference-batcher", daemon=True)
+        self.thread.start()
+    
+    def _collect(self):
+        camera, frame = self.scheduler.next_job(timeout=1)
+        if camera is None:
+            return []
+        
+        batch = [(camera, frame)]
+        deadline = time.monotonic() + self.timeout
+        
+        while len(batch) < self.batch_size:
+            remaining = deadline - time.monotonic()
+            if remaining <= 0:
+                break
+            camera, frame = self.scheduler.next_job(timeout=remaining)
+            if camera is None:
+                break
+            batch.append((camera, frame))
+        
+        return batch
+    
+    def _run(self):
+        while True:
+            batch = self._collect()
+            if not batch:
+                continue
+            
+            try:
+                detections = detect_persons_batch([frame for _, frame in batch],
+                                                  [camera.zones for camera, _ in batch])
+            except Exception as e:
+                print(f"[AI Error] Batch inference failed: {e}")
+                for camera, _ in batch:
+                    self.scheduler.done(camera)
+                continue
+            
+            for (camera, frame), frame_detections in zip(batch, detections):
+                self.results.put((camera, frame, frame_detections))
 
-def delete_old_detections():
-    """Delete detections older than AUTO_DELETE_AFTER days"""
-    if AUTO_DELETE_AFTER <= 0:
-        return
+class InferenceWorkerPool:
+    """Bounded pool of worker threads sharing one model and face index"""
     
-    cutoff_date = datetime.now() - timedelta(days=AUTO_DELETE_AFTER)
-    conn = sqlite3.connect(DATABASE_PATH)
-    cursor = conn.cursor()
+    def __init__(self, scheduler, batcher, handler, workers=INFERENCE_WORKERS):
+        self.scheduler = scheduler
+        self.batcher = batcher
+        self.handler = handler
+        self.workers = max(1, workers)
+        self.threads = []
     
-    # Get old detections
-    cursor.execute('''
-        SELECT id, original_photo_path, zoom_photo_path 
-        FROM detections 
-        WHERE timestamp < ?
-    ''', (cutoff_date.isoformat(),))
+    def start(self):
+        self.batcher.start()
+        for i in range(self.workers):
+            thread = threading.Thread(target=self._run, name=f"inference-{i}", daemon=True)
+            thread.start()
+            self.threads.append(thread)
+    
+    def _run(self):
+        while True:
+            camera, frame, detections = self.batcher.results.get()
+            
+            start_time = time.perf_counter()
+            try:
+                self.handler(camera, frame, detections)
+                recognition_latency_histogram.observe((time.perf_counter() - start_time) * 1000)
+            except Exception as e:
+                print(f"[AI Error] {camera.name}: {e}")
+            finally:
+                self.scheduler.done(camera)
+
+def inference_process_main(jobs, results, model_path=None):
+    """Inference process: YOLO and face encodings for frames in shared memory"""
+    models.load_detector = True
+    models.detector_model_path = model_path
+    # Names are matched against the face index in the main process
+    models.load_known_faces = False
+    models.load()
     
-    old_detections = cursor.fetchall()
+    segments = {}
+    running = True
     
-    # Delete files and database records
-    for detection in old_detections:
-        detection_id, original_path, zoom_path = detection
+    while running:
+        batch = [jobs.get()]
+        while len(batch) < YOLO_BATCH_SIZE and batch[-1] is not None:
+            try:
+                batch.append(jobs.get_nowait())
+            except queue.Empty:
+                break
+        
+        if batch[-1] is None:
+            batch.pop()
+            running = False
+        if not batch:
+            continue
         
-        # Delete files
+        frames = []
+        for job_id, slot, slot_name, shape, skip_boxes, zones in batch:
+            segment = segments.get(slot)
+            if segment is None or segment.name != slot_name:
+                if segment is not None:
+                    segment.close()
+                # Spawned processes share the parent's resource tracker, so
+                # attaching does not make this process own the segment
+                segment = segments[slot] = shared_memory.SharedMemory(name=slot_name)
+            frames.append(np.ndarray(shape, dtype=np.uint8, buffer=segment.buf))
+        
+        start_time = time.perf_counter()
         try:
-            if original_path and os.path.exists(original_path):
-                os.remove(original_path)
-            if zoom_path and os.path.exists(zoom_path):
-                os.remove(zoom_path)
+            detections = detect_persons_batch(frames, [job[5] for job in batch])
         except Exception as e:
-            print(f"Error deleting files: {e}")
+            print(f"[AI Error] Batch inference failed: {e}")
+            detections = [None] * len(batch)
+        batch_ms = (time.perf_counter() - start_time) * 1000
         
-        # Delete from database
-        cursor.execute('DELETE FROM detections WHERE id = ?', (detection_id,))
-    
-    conn.commit()
-    conn.close()
+        for position, (job, frame, frame_detections) in enumerate(zip(batch, frames, detections)):
+            job_id, skip_boxes = job[0], job[4]
+            faces = None
+            if frame_detections is not None:
+                faces = [None if any(bbox_iou(bbox, box) >= TRACK_IOU_THRESHOLD for box in skip_boxes)
+                         else encode_person_face(frame, bbox)
+                         for bbox, _ in frame_detections]
+            # Batch timing is reported once per batch
+            timing = (batch_ms, len(batch)) if position == 0 else None
+            results.put((job_id, frame_detections, faces, timing))
+        
+        # Views must go before their segment can be closed
+        del frames
     
-    if old_detections:
-        print(f"[Cleanup] Deleted {len(old_detections)} old detections")
+    for segment in segments.values():
+        segment.close()
 
-# ============== FACE RECOGNITION ==============
-def load_known_faces():
-    """Load known faces from known_faces directory"""
-    known_encodings = []
-    known_names = []
+class ProcessInferencePool:
+    """Run YOLO and face encoding in separate processes, outside the GIL.
     
-    for image_path in KNOWN_FACES_DIR.glob('*.jpg'):
-        name = image_path.stem
-        
-        # Load image and detect faces
-        image = face_recognition.load_image_file(str(image_path))
-        
-        # Detect face locations using HOG (CPU optimized)
-        face_locations = face_recognition.face_locations(image, model='hog')
-        
-        if face_locations:
-            # Get first face encoding
-            face_encoding = face_recognition.face_encodings(image, face_locations)[0]
-            known_encodings.append(face_encoding)
-            known_names.append(name)
+    A dispatcher thread copies each scheduled frame into a free
+    shared-memory slot and sends only the slot name, frame shape, detection
+    zones and the boxes of already-identified tracks over a queue. Inference processes
+    batch what is waiting, run YOLO and encode faces, and return boxes and
+    128-d encodings. Handler threads in the main process do tracking, face
+    index matching and alerting. Jobs with no answer after
+    INFERENCE_JOB_TIMEOUT seconds are abandoned and dead processes restarted.
+    """
     
-    return known_encodings, known_names
-
-def recognize_face(face_image, known_encodings, known_names):
-    """Recognize face from image"""
-    try:
-        # Detect faces using HOG
-        face_locations = face_recognition.face_locations(face_image, model='hog')
-        
-        if not face_locations:
-            return None, None
+    def __init__(self, scheduler, handler, processes=INFERENCE_PROCESSES, workers=INFERENCE_WORKERS):
+        self.scheduler = scheduler
+        self.handler = handler
+        self.process_count = processes or max(1, (os.cpu_count() or 2) - 1)
+        self.workers = max(1, workers)
+        self.context = multiprocessing.get_context('spawn')
+        self.jobs = self.context.Queue()
+        self.results = self.context.Queue()
+        self.processes = []
+        self.threads = []
+        # Two slots per process so the next frame is ready when one finishes
+        self.slots = [None] * (self.process_count * 2)
+        self.free_slots = queue.Queue()
+        for slot in range(len(self.slots)):
+            self.free_slots.put(slot)
+        self.pending = {}
+        self.lock = threading.Lock()
+        self.next_job_id = 0
+        self.jobs_abandoned = 0
+        self.process_restarts = 0
+        self.model_path = None
+    
+    def start(self):
+        # Split the cores between processes unless threads were set explicitly;
+        # spawned processes read these when they import this module and torch
+        threads = str(max(1, (os.cpu_count() or 1) // self.process_count))
+        os.environ.setdefault('OMP_NUM_THREADS', threads)
+        if not DETECTOR_THREADS:
+            os.environ['DETECTOR_THREADS'] = threads
         
-        # Get face encoding
-        face_encoding = face_recognition.face_encodings(face_image, face_locations)[0]
+        # Export/quantize here, once, so workers never race on the model files
+        self.model_path = detector_model_path()
         
-        # Compare with known faces
-        matches = face_recognition.compare_faces(known_encodings, face_encoding, tolerance=0.6)
+        for _ in range(self.process_count):
+            self._start_process()
         
-        if True in matches:
-            match_index = matches.index(True)
-            return known_names[match_index], face_locations[0]
+        targets = [('inference-dispatcher', self._dispatch), ('inference-monitor', self._monitor)]
+        targets += [(f"inference-{i}", self._collect) for i in range(self.workers)]
+        for name, target in targets:
+            thread = threading.Thread(target=target, name=name, daemon=True)
+            thread.start()
+            self.threads.append(thread)
         
-        return None, face_locations[0]
+        atexit.register(self.stop)
     
-    except Exception as e:
-        print(f"[Face Recognition Error] {e}")
-        return None, None
-
-# ============== AI DETECTION ==============
-# Load YOLOv8n model (nano version for CPU)
-yolo_model = YOLO('yolov8n.pt')
+    def _start_process(self):
+        process = self.context.Process(target=inference_process_main,
+                                       args=(self.jobs, self.results, self.model_path),
+                                       name='inference-process', daemon=True)
+        process.start()
+        self.processes.append(process)
+    
+    def _slot_for(self, slot, size):
+        segment = self.slots[slot]
+        if segment is None or segment.size < size:
+            if segment is not None:
+                segment.close()
+                segment.unlink()
+            segment = self.slots[slot] = shared_memory.SharedMemory(create=True, size=size)
+        return segment
+    
+    def _dispatch(self):
+        while True:
+            camera, frame = self.scheduler.next_job(timeout=1)
+            if camera is None:
+                continue
+            
+            slot = self.free_slots.get()
+            segment = self._slot_for(slot, frame.nbytes)
+            np.ndarray(frame.shape, dtype=np.uint8, buffer=segment.buf)[:] = frame
+            
+            # The camera is busy until this job is done, so its tracker is stable
+            skip_boxes = camera.tracker.identified_boxes(time.time())
+            
+            with self.lock:
+                self.next_job_id += 1
+                job_id = self.next_job_id
+                self.pending[job_id] = (camera, frame, slot, time.monotonic())
+            self.jobs.put((job_id, slot, segment.name, frame.shape, skip_boxes, camera.zones))
+    
+    def _finish(self, job_id):
+        with self.lock:
+            job = self.pending.pop(job_id, None)
+        if job is None:
+            return None
+        camera, frame, slot, _ = job
+        self.free_slots.put(slot)
+        return camera, frame
+    
+    def _collect(self):
+        while True:
+            try:
+                job_id, detections, faces, timing = self.results.get(timeout=1)
+            except queue.Empty:
+                continue
+            
+            job = self._finish(job_id)
+            if job is None:
+                continue
+            camera, frame = job
+            
+            if timing:
+                batch_latency_histogram.observe(timing[0])
+                batch_size_histogram.observe(timing[1])
+            
+            start_time = time.perf_counter()
+            try:
+                if detections is not None:
+                    self.handler(camera, frame, detections, faces)
+                    recognition_latency_histogram.observe((time.perf_counter() - start_time) * 1000)
+            except Exception as e:
+                print(f"[AI Error] {camera.name}: {e}")
+            finally:
+                self.scheduler.done(camera)
+    
+    def _monitor(self):
+        while True:
+            time.sleep(5)
+            
+            for process in list(self.processes):
+                if not process.is_alive():
+                    print(f"[AI Error] Inference process exited ({process.exitcode}), restarting")
+                    self.processes.remove(process)
+                    self._start_process()
+                    self.process_restarts += 1
+            
+            now = time.monotonic()
+            with self.lock:
+                expired = [job_id for job_id, job in self.pending.items() if now - job[3] > INFERENCE_JOB_TIMEOUT]
+            for job_id in expired:
+                job = self._finish(job_id)
+                if job:
+                    self.jobs_abandoned += 1
+                    self.scheduler.done(job[0])
+    
+    def cpu_seconds(self):
+        """CPU time used by the live inference processes, from /proc"""
+        seconds = 0.0
+        for process in self.processes:
+            try:
+                with open(f'/proc/{process.pid}/stat') as f:
+                    # utime and stime, counted from the state field after the name
+                    fields = f.read().rsplit(')', 1)[1].split()
+                seconds += (int(fields[11]) + int(fields[12])) / os.sysconf('SC_CLK_TCK')
+            except (OSError, ValueError, IndexError):
+                pass
+        return seconds
+    
+    def stop(self):
+        for _ in self.processes:
+            self.jobs.put(None)
+        for process in self.processes:
+            process.join(timeout=5)
+        for segment in self.slots:
+            if segment is not None:
+                segment.close()
+                segment.unlink()
+        self.slots = [None] * len(self.slots)
+    
+    def stats(self):
+        with self.lock:
+            pending = len(self.pending)
+        return {
+            'processes': sum(process.is_alive() for process in self.processes),
+            'pending_jobs': pending,
+            'jobs_abandoned': self.jobs_abandoned,
+            'process_restarts': self.process_restarts,
+        }
 
-# Load known faces
-known_encodings, known_names = load_known_faces()
+def start_inference(scheduler, handler):
+    """Start the INFERENCE_MODE pool ('thread' or 'process') and return it"""
+    if INFERENCE_MODE == 'process':
+        pool = ProcessInferencePool(scheduler, handler)
+    else:
+        pool = InferenceWorkerPool(scheduler, InferenceBatcher(scheduler), handler)
+    pool.start()
+    return pool
 
-# Global variable for latest frame
-latest_frame = None
-frame_lock = threading.Lock()
+inference_pool = None
+cameras = []
 
-def zoom_frame(frame, bbox, zoom_factor=2):
-    """Zoom into the specified bounding box area"""
+def zoom_frame(frame, bbox, zoom_factor=2, max_size=(640, 480)):
+    """Zoom into the specified bounding box area.
+    
+    The crop keeps its aspect ratio and is scaled to fit max_size. Returns
+    (zoomed, scale, (x, y)) like face_search_region, with (x, y) the crop
+    origin in the frame.
+    """
     x1, y1, x2, y2 = bbox
     
     # Calculate center
@@ -242,116 +3017,473 @@ def zoom_frame(frame, bbox, zoom_factor=2):
     new_x2 = min(frame.shape[1], new_x1 + zoom_width)
     new_y2 = min(frame.shape[0], new_y1 + zoom_height)
     
-    # Crop and resize
+    # Crop (a view of the shared frame) and resize into a new image
     zoomed = frame[new_y1:new_y2, new_x1:new_x2]
     
     # Resize to a reasonable size for sending
-    zoomed = cv2.resize(zoomed, (640, 480))
+    crop_height, crop_width = zoomed.shape[:2]
+    scale = min(max_size[0] / crop_width, max_size[1] / crop_height)
+    zoomed = cv2.resize(zoomed, (max(1, round(crop_width * scale)), max(1, round(crop_height * scale))))
+    
+    return zoomed, scale, (new_x1, new_y1)
+
+def draw_person(image, person, scale=1.0, offset=(0, 0)):
+    """Draw a person's box and label; image is the frame scaled by scale from offset"""
+    offset_x, offset_y = offset
+    x1, y1, x2, y2 = person['bbox']
+    x1, x2 = int((x1 - offset_x) * scale), int((x2 - offset_x) * scale)
+    y1, y2 = int((y1 - offset_y) * scale), int((y2 - offset_y) * scale)
+    
+    color = (0, 255, 0) if person['status'] == 'known' else (0, 0, 255)
+    cv2.rectangle(image, (x1, y1), (x2, y2), color, 2)
+    label = f"{person['person_name']} ({person['confidence']:.2f})"
+    cv2.putText(image, label, (x1, y1-10), 
+               cv2.FONT_HERSHEY_SIMPLEX, 0.5, color, 2)
+
+def annotated_snapshot(frame, persons):
+    """Copy of a frame for saving, at most SNAPSHOT_WIDTH wide, with the persons drawn"""
+    height, width = frame.shape[:2]
+    scale = 1.0
+    if SNAPSHOT_WIDTH and width > SNAPSHOT_WIDTH:
+        scale = SNAPSHOT_WIDTH / width
+        snapshot = cv2.resize(frame, (SNAPSHOT_WIDTH, int(height * scale)), interpolation=cv2.INTER_AREA)
+    else:
+        snapshot = frame.copy()
+    
+    for person in persons:
+        draw_person(snapshot, person, scale)
+    return snapshot
+
+class DetectionZones:
+    """Where a camera looks for people.
+    
+    'detection_zones' in cameras.json lists polygons in normalized 0..1
+    coordinates, optionally with their own YOLO input size:
+    
+        "detection_zones": [
+            {"polygon": [[0.62, 0.1], [0.7, 0.1], [0.7, 0.35], [0.62, 0.35]], "input_size": 320},
+            [[0.0, 0.45], [1.0, 0.45], [1.0, 1.0], [0.0, 1.0]]
+        ]
+    
+    Only the bounding rectangle of each zone is cropped, at full
+    resolution, and letterboxed by the detector to the zone's input_size
+    (DETECTOR_INPUT_SIZE by default, rounded down to a multiple of 32). A
+    zone costs input_size squared, so a small far-away doorway can get more
+    of its own pixels for less than a full frame, and the sky or walls cost
+    nothing. Crops are batched per input size. Boxes are
+    mapped back to the frame, merged across overlapping zones with NMS and
+    kept only when their centre lies inside a zone and outside every
+    'detection_ignore' polygon. Without zones the whole frame is one zone.
+    """
     
-    return zoomed
+    def __init__(self, zones=None, ignore=None):
+        self.zones = []
+        for zone in zones or []:
+            if not isinstance(zone, dict):
+                zone = {'polygon': zone}
+            if len(zone.get('polygon') or []) < 3:
+                raise ValueError(f"Detection zone needs a polygon of at least 3 points: {zone}")
+            input_size = int(zone.get('input_size') or DETECTOR_INPUT_SIZE)
+            self.zones.append({'polygon': zone['polygon'], 'input_size': max(32, input_size // 32 * 32)})
+        self.ignore = ignore or []
+        self._pixels = {}
+    
+    def _pixel_polygons(self, width, height):
+        """Zone and ignore polygons in pixels, cached per frame size"""
+        if (width, height) not in self._pixels:
+            def scale(polygon):
+                return np.array([[x * width, y * height] for x, y in polygon], dtype=np.float32)
+            self._pixels[(width, height)] = ([scale(zone['polygon']) for zone in self.zones],
+                                             [scale(polygon) for polygon in self.ignore])
+        return self._pixels[(width, height)]
+    
+    def crops(self, frame):
+        """[(image, scale, (x, y), input_size)] for YOLO, with (x, y) the crop origin in the frame.
+        
+        input_size None means the detector's default.
+        """
+        if not self.zones:
+            resized, scale = resize_for_detection(frame)
+            return [(resized, scale, (0, 0), None)]
+        
+        height, width = frame.shape[:2]
+        crops = []
+        for zone, polygon in zip(self.zones, self._pixel_polygons(width, height)[0]):
+            x, y, crop_width, crop_height = cv2.boundingRect(polygon)
+            x1, y1 = max(0, x), max(0, y)
+            x2, y2 = min(width, x + crop_width), min(height, y + crop_height)
+            if x2 - x1 < 2 or y2 - y1 < 2:
+                continue
+            
+            # A view; the detector's letterbox scales it to the zone's input size
+            crops.append((frame[y1:y2, x1:x2], 1.0, (x1, y1), zone['input_size']))
+        return crops
+    
+    def select(self, frame_shape, detections):
+        """Merge duplicates from overlapping zones and drop boxes outside the zones"""
+        if not self.zones and not self.ignore:
+            return detections
+        
+        height, width = frame_shape[:2]
+        zones, ignore = self._pixel_polygons(width, height)
+        
+        if len(zones) > 1 and len(detections) > 1:
+            boxes = [[x1, y1, x2 - x1, y2 - y1] for (x1, y1, x2, y2), _ in detections]
+            keep = cv2.dnn.NMSBoxes(boxes, [float(confidence) for _, confidence in detections],
+                                    0.0, DETECTOR_NMS_IOU)
+            detections = [detections[i] for i in np.array(keep).flatten()]
+        
+        def inside(polygon, point):
+            return cv2.pointPolygonTest(polygon, point, False) >= 0
+        
+        selected = []
+        for bbox, confidence in detections:
+            x1, y1, x2, y2 = bbox
+            center = ((x1 + x2) / 2, (y1 + y2) / 2)
+            if zones and not any(inside(polygon, center) for polygon in zones):
+                continue
+            if any(inside(polygon, center) for polygon in ignore):
+                continue
+            selected.append((bbox, confidence))
+        return selected
 
-def process_frame(frame):
-    """Process frame for person detection and face recognition"""
-    # Resize frame for CPU optimization
+WHOLE_FRAME = DetectionZones()
+
+def resize_for_detection(frame):
+    """Resize a frame to FRAME_RESIZE_WIDTH; returns (resized, scale)"""
     height, width = frame.shape[:2]
     scale = FRAME_RESIZE_WIDTH / width
-    resized_frame = cv2.resize(frame, (FRAME_RESIZE_WIDTH, int(height * scale)))
+    return cv2.resize(frame, (FRAME_RESIZE_WIDTH, int(height * scale))), scale
+
+def detect_persons_batch(frames, zones=None):
+    """Run one batched YOLO call and return person boxes for each frame.
+    
+    zones optionally holds the DetectionZones of each frame; every zone
+    crop is one image of the batch, with one detector call per input size.
+    """
+    if not frames:
+        return []
+    
+    zones = [frame_zones or WHOLE_FRAME for frame_zones in zones or [None] * len(frames)]
+    
+    # Crop and resize frames for CPU optimization, grouped by detector input size
+    groups = {}
+    for index, (frame, frame_zones) in enumerate(zip(frames, zones)):
+        for image, scale, offset, input_size in frame_zones.crops(frame):
+            groups.setdefault(input_size, []).append((image, index, scale, offset))
     
     # Detect persons using YOLOv8n
-    results = yolo_model(resized_frame, classes=[0], conf=CONFIDENCE_THRESHOLD, verbose=False)
+    results = []
+    if groups:
+        start_time = time.perf_counter()
+        with yolo_lock:
+            for input_size, crops in groups.items():
+                boxes = person_detector.detect([image for image, *_ in crops], input_size=input_size)
+                results.extend(zip(boxes, crops))
+        batch_latency_histogram.observe((time.perf_counter() - start_time) * 1000)
+    batch_size_histogram.observe(len(frames))
+    
+    # Results come back in input order, one per crop
+    detections = [[] for _ in frames]
+    for boxes, (_, index, scale, (offset_x, offset_y)) in results:
+        for x1, y1, x2, y2, confidence in boxes:
+            # Scale back to original frame
+            bbox = (int(x1 / scale) + offset_x, int(y1 / scale) + offset_y,
+                    int(x2 / scale) + offset_x, int(y2 / scale) + offset_y)
+            detections[index].append((bbox, confidence))
+    
+    return [frame_zones.select(frame.shape, frame_detections)
+            for frame, frame_zones, frame_detections in zip(frames, zones, detections)]
+
+def encode_person_face(frame, bbox):
+    """Encode the face in a person box.
+    
+    Returns None when the box has no usable head region, otherwise
+    (encoding, location) with the location in full-frame coordinates, or
+    (None, None) when no face was found.
+    """
+    # Search only the head region of the person
+    region, scale, (offset_x, offset_y) = face_search_region(frame, bbox)
+    if region is None:
+        return None
+    
+    face_encoding, face_location = encode_face(region)
+    if face_encoding is None:
+        return None, None
+    
+    # Map the face back to full-frame coordinates
+    top, right, bottom, left = face_location
+    return face_encoding, (
+        int(top / scale) + offset_y,
+        int(right / scale) + offset_x,
+        int(bottom / scale) + offset_y,
+        int(left / scale) + offset_x
+    )
+
+def recognize_persons(frame, detections, tracker=None, faces=None):
+    """Run face recognition on each detected person box.
     
+    With a tracker, each person gets a track and face recognition runs once
+    per track (retried every FACE_RETRY_INTERVAL until confidently matched).
+    faces, when given, holds the encode_person_face() result for each
+    detection, already computed by an inference process.
+    """
+    start_time = time.perf_counter()
+    now = time.time()
+    face_encodings = []
+    face_owners = []
     persons_detected = []
     
-    for result in results:
-        boxes = result.boxes
+    if tracker:
+        tracks = tracker.update([bbox for bbox, _ in detections], now)
+    else:
+        tracks = [None] * len(detections)
+    
+    for index, ((bbox, confidence), track) in enumerate(zip(detections, tracks)):
+        person = {
+            'bbox': bbox,
+            'confidence': confidence,
+            'person_name': 'Unknown',
+            'status': 'unknown',
+            'face_location': None,
+            'face_distance': None,
+            'track': track
+        }
+        persons_detected.append(person)
         
-        for box in boxes:
-            # Get bounding box coordinates
-            x1, y1, x2, y2 = box.xyxy[0].cpu().numpy()
-            confidence = box.conf[0].cpu().numpy()
-            
-            # Scale back to original frame
-            x1 = int(x1 / scale)
-            y1 = int(y1 / scale)
-            x2 = int(x2 / scale)
-            y2 = int(y2 / scale)
+        # Reuse the track's identity instead of re-encoding the face
+        if track and not track.needs_recognition(now):
+            if track.person_name:
+                person['person_name'] = track.person_name
+                person['status'] = 'known'
+            person['face_distance'] = track.face_distance
+            continue
+        
+        if track:
+            track.last_recognition = now
+        
+        face = faces[index] if faces is not None else encode_person_face(frame, bbox)
+        if face is None:
+            continue
+        
+        face_encoding, face_location = face
+        face_attempts_counter.inc()
+        
+        if face_encoding is not None:
+            person['face_location'] = face_location
+            face_encodings.append(face_encoding)
+            face_owners.append(person)
+    
+    # Match all faces in the frame with a single index lookup
+    if face_encodings:
+        for person, (person_name, distance) in zip(face_owners, face_index.match(face_encodings)):
+            person['face_distance'] = distance
+            if person_name:
+                person['person_name'] = person_name
+                person['status'] = 'known'
+                face_matches_counter.inc()
+            if person['track']:
+                person['track'].set_identity(person_name, distance, now)
+    
+    persons_per_frame_histogram.observe(len(persons_detected))
+    face_stage_histogram.observe((time.perf_counter() - start_time) * 1000)
+    return persons_detected
+
+# ============== TELEGRAM BOT ==============
+pending_detections = {}  # Store detection ID for self-learning
+
+class TokenBucket:
+    """Async token bucket: rate tokens per second, up to capacity banked (rate <= 0 = unlimited)"""
+    
+    def __init__(self, rate, capacity):
+        self.rate = rate
+        self.capacity = max(1, capacity)
+        self.tokens = float(self.capacity)
+        self.updated = time.monotonic()
+    
+    async def acquire(self, tokens=1):
+        if self.rate <= 0:
+            return
+        tokens = min(tokens, self.capacity)
+        while True:
+            now = time.monotonic()
+            self.tokens = min(self.capacity, self.tokens + (now - self.updated) * self.rate)
+            self.updated = now
+            if self.tokens >= tokens:
+                self.tokens -= tokens
+                return
+            await asyncio.sleep((tokens - self.tokens) / self.rate)
+
+class TelegramDispatcher:
+    """Deliver detection alerts from worker threads on the bot's event loop.
+    
+    submit() is thread-safe and never blocks: alerts wait in a bounded
+    backlog and a single sender task on the bot loop uploads both photos
+    from memory as one media group. Sends are paced by a token bucket
+    (TELEGRAM_RATE_PER_MINUTE messages, TELEGRAM_BURST burst). Under a
+    burst, a new alert for a camera that already has one waiting is merged
+    into it, and the oldest alert is dropped once the backlog is full.
+    """
+    
+    def __init__(self):
+        self.bot = None
+        self.loop = None
+        self.wakeup = None
+        self.backlog = deque()
+        self.lock = threading.Lock()
+        self.bucket = TokenBucket(TELEGRAM_RATE_PER_MINUTE / 60, TELEGRAM_BURST)
+        self.send_latency = Histogram(LATENCY_BUCKETS_MS)
+        self.sent = 0
+        self.dropped = 0
+        self.coalesced = 0
+        self.errors = 0
+    
+    def attach(self, bot, loop):
+        """Start the sender task; must be called on the bot's event loop"""
+        self.bot = bot
+        self.loop = loop
+        self.wakeup = asyncio.Event()
+        loop.create_task(self._sender())
+        if self.backlog:
+            self.wakeup.set()
+    
+    def submit(self, alert):
+        """Queue an alert from any thread"""
+        if not TELEGRAM_BOT_TOKEN or not TELEGRAM_CHAT_ID:
+            return
+        
+        with self.lock:
+            for pending in self.backlog:
+                if pending['camera_name'] == alert['camera_name']:
+                    # Burst on one camera: one message with a count instead of many
+                    pending['count'] += 1
+                    if alert['person_name'] != 'Unknown' and alert['person_name'] not in pending['names']:
+                        pending['names'].append(alert['person_name'])
+                    # The caption reports a known person once one is named
+                    if alert['status'] == 'known':
+                        pending['status'] = 'known'
+                    self.coalesced += 1
+                    return
             
-            # Extract person area
-            person_area = frame[y1:y2, x1:x2]
+            if len(self.backlog) >= TELEGRAM_MAX_BACKLOG:
+                self.backlog.popleft()
+                self.dropped += 1
             
-            # Recognize face
-            person_name, face_location = recognize_face(person_area, known_encodings, known_names)
+            alert['count'] = 1
+            alert['names'] = [alert['person_name']] if alert['person_name'] != 'Unknown' else []
+            # Status of the detection in the photos, which replies relabel
+            alert['photo_status'] = alert['status']
+            self.backlog.append(alert)
+        
+        if self.loop:
+            self.loop.call_soon_threadsafe(self.wakeup.set)
+    
+    async def _sender(self):
+        while True:
+            await self.wakeup.wait()
+            self.wakeup.clear()
             
-            status = 'known' if person_name else 'unknown'
+            while True:
+                with self.lock:
+                    if not self.backlog:
+                        break
+                    alert = self.backlog.popleft()
+                
+                # A media group of two photos counts as two messages
+                await self.bucket.acquire(2)
+                await self._send(alert)
+    
+    async def _send(self, alert):
+        caption = build_detection_caption(alert)
+        media = [
+            InputMediaPhoto(alert['original_jpeg'], caption=caption),
+            InputMediaPhoto(alert['zoom_jpeg'], caption="[Foto Zoom]"),
+        ]
+        
+        for attempt in range(2):
+            start_time = time.perf_counter()
+            try:
+                messages = await self.bot.send_media_group(chat_id=TELEGRAM_CHAT_ID, media=media)
+            except RetryAfter as e:
+                # Telegram asked us to slow down; wait once and retry
+                await asyncio.sleep(e.retry_after)
+                continue
+            except Exception as e:
+                self.errors += 1
+                print(f"[Telegram Error] Failed to send notification: {e}")
+                return
             
-            persons_detected.append({
-                'bbox': (x1, y1, x2, y2),
-                'confidence': float(confidence),
-                'person_name': person_name if person_name else 'Unknown',
-                'status': status,
-                'face_location': face_location
-            })
+            self.send_latency.observe((time.perf_counter() - start_time) * 1000)
+            self.sent += 1
+            remember_detection_messages([m.message_id for m in messages], alert)
+            return
+        
+        self.errors += 1
+        print("[Telegram Error] Rate limited, notification dropped")
     
-    return persons_detected
+    def stats(self):
+        with self.lock:
+            backlog = len(self.backlog)
+        return {
+            'backlog': backlog,
+            'sent': self.sent,
+            'dropped': self.dropped,
+            'coalesced': self.coalesced,
+            'errors': self.errors,
+            'send_latency_ms': self.send_latency.snapshot(),
+        }
 
-# ============== TELEGRAM BOT ==============
-pending_detections = {}  # Store detection ID for self-learning
+telegram_dispatcher = TelegramDispatcher()
 
-async def send_detection_notification(original_frame, zoomed_frame, person_name, status, timestamp):
-    """Send detection notification to Telegram"""
-    if not TELEGRAM_BOT_TOKEN or not TELEGRAM_CHAT_ID:
-        return
+MAX_PENDING_DETECTIONS = 1000
+
+def remember_detection_messages(message_ids, alert):
+    """Map each sent photo to its detection so replies can teach the name"""
+    info = {
+        'timestamp': alert['timestamp'],
+        'zoom_path': alert['zoom_path'],
+        'status': alert['photo_status'],
+        'message_ids': message_ids
+    }
+    for message_id in message_ids:
+        pending_detections[message_id] = info
     
-    timestamp_str = datetime.now().strftime('%Y-%m-%d %H:%M:%S')
+    # Forget the oldest notifications so this never grows without bound
+    while len(pending_detections) > MAX_PENDING_DETECTIONS:
+        del pending_detections[next(iter(pending_detections))]
+
+def build_detection_caption(alert):
+    """Caption for a (possibly coalesced) detection alert"""
+    timestamp_str = datetime.fromisoformat(alert['timestamp']).strftime('%Y-%m-%d %H:%M:%S')
+    status = alert['status']
     
     # Prepare caption with detailed info
     caption = f"""🚨 PERSON DETECTED
 
 📅 Tanggal: {timestamp_str}
 👤 Status: {'Dikenal' if status == 'known' else 'Tidak Dikenal'}
-📍 Lokasi: {CAMERA_NAME}"""
+📍 Lokasi: {alert['camera_name']}"""
     
-    if person_name and person_name != 'Unknown':
-        caption += f"\n🏷️ Nama: {person_name}"
+    if alert['names']:
+        caption += f"\n🏷️ Nama: {', '.join(alert['names'])}"
     
-    caption += "\n\nReply foto ini dengan nama untuk menambah ke known_faces"
-    
-    try:
-        # Save photos temporarily
-        timestamp_id = int(time.time())
-        original_path = UPLOADS_DIR / f"temp_original_{timestamp_id}.jpg"
-        zoom_path = UPLOADS_DIR / f"temp_zoom_{timestamp_id}.jpg"
-        
-        cv2.imwrite(str(original_path), original_frame)
-        cv2.imwrite(str(zoom_path), zoomed_frame)
-        
-        # Send original photo
-        with open(original_path, 'rb') as photo:
-            message = await bot.send_photo(
-                chat_id=TELEGRAM_CHAT_ID,
-                photo=photo,
-                caption=f"{caption}\n\n[Foto Original]"
-            )
-        
-        # Store detection info for self-learning
-        detection_id = message.message_id
-        pending_detections[detection_id] = {
-            'timestamp': timestamp,
-            'original_path': str(original_path),
-            'zoom_path': str(zoom_path),
-            'status': status
-        }
-        
-        # Send zoomed photo
-        with open(zoom_path, 'rb') as photo:
-            await bot.send_photo(
-                chat_id=TELEGRAM_CHAT_ID,
-                photo=photo,
-                caption="[Foto Zoom]"
-            )
+    if alert['count'] > 1:
+        caption += f"\n➕ {alert['count'] - 1} deteksi lain"
     
-    except Exception as e:
-        print(f"[Telegram Error] Failed to send notification: {e}")
+    caption += "\n\nReply foto ini dengan nama untuk menambah ke known_faces"
+    return caption
+
+def send_detection_notification(original_jpeg, zoom_jpeg, person_name, status, timestamp, camera_name, zoom_path):
+    """Queue a detection notification for Telegram (returns immediately)"""
+    telegram_dispatcher.submit({
+        'original_jpeg': original_jpeg,
+        'zoom_jpeg': zoom_jpeg,
+        'person_name': person_name,
+        'status': status,
+        'timestamp': timestamp,
+        'camera_name': camera_name,
+        'zoom_path': zoom_path,
+    })
 
 async def handle_photo(update: Update, context: ContextTypes.DEFAULT_TYPE):
     """Handle manual photo upload with name in caption"""
@@ -369,6 +3501,9 @@ async def handle_photo(update: Update, context: ContextTypes.DEFAULT_TYPE):
     name = caption.strip()
     
     try:
+        # Face recognition may still be warming up
+        await asyncio.to_thread(models.load)
+        
         # Download photo
         photo_file = await photo.get_file()
         photo_path = UPLOADS_DIR / f"upload_{int(time.time())}.jpg"
@@ -378,24 +3513,15 @@ async def handle_photo(update: Update, context: ContextTypes.DEFAULT_TYPE):
         image = cv2.imread(str(photo_path))
         rgb_image = cv2.cvtColor(image, cv2.COLOR_BGR2RGB)
         
-        # Detect face
-        face_locations = face_recognition.face_locations(rgb_image, model='hog')
+        # Detect face off the event loop so the bot stays responsive
+        face_locations = await asyncio.to_thread(face_recognition.face_locations, rgb_image, model='hog')
         
         if not face_locations:
             await update.message.reply_text("❌ Tidak ada wajah terdeteksi di foto")
             return
         
-        # Extract and save face
-        top, right, bottom, left = face_locations[0]
-        face_image = rgb_image[top:bottom, left:right]
-        
-        # Save to known_faces
-        face_path = KNOWN_FACES_DIR / f"{name}.jpg"
-        cv2.imwrite(str(face_path), cv2.cvtColor(face_image, cv2.COLOR_RGB2BGR))
-        
-        # Reload known faces
-        global known_encodings, known_names
-        known_encodings, known_names = load_known_faces()
+        # Save face and add it to the index
+        await asyncio.to_thread(enroll_face, name, rgb_image, face_locations[0])
         
         await update.message.reply_text(f"✅ Wajah {name} berhasil ditambahkan!")
         
@@ -411,66 +3537,48 @@ async def handle_message(update: Update, context: ContextTypes.DEFAULT_TYPE):
     # Check if replying to a detection
     reply_message_id = update.message.reply_to_message.message_id
     
-    # Find the detection (check if it's the original photo or zoom photo)
-    detection_id = None
-    if reply_message_id in pending_detections:
-        detection_id = reply_message_id
-    else:
-        # Check if it's a reply to zoom photo (find the original)
-        for det_id, det_info in pending_detections.items():
-            if reply_message_id == det_id + 1:  # Zoom photo is sent after original
-                detection_id = det_id
-                break
+    # Both photos of a notification map to the same detection
+    detection_info = pending_detections.get(reply_message_id)
     
-    if detection_id is None:
+    if detection_info is None:
         return
-    
-    detection_info = pending_detections[detection_id]
+
     name = update.message.text.strip()
     
     if not name:
         return
     
     try:
+        # Face recognition may still be warming up
+        await asyncio.to_thread(models.load)
+        
         # Load zoomed photo (better quality for face recognition)
         image = cv2.imread(detection_info['zoom_path'])
         rgb_image = cv2.cvtColor(image, cv2.COLOR_BGR2RGB)
         
         # Detect and extract face
-        face_locations = face_recognition.face_locations(rgb_image, model='hog')
+        face_locations = await asyncio.to_thread(face_recognition.face_locations, rgb_image, model='hog')
         
         if not face_locations:
             await update.message.reply_text("❌ Tidak ada wajah terdeteksi di foto")
             return
         
-        # Extract and save face
-        top, right, bottom, left = face_locations[0]
-        face_image = rgb_image[top:bottom, left:right]
-        
-        # Save to known_faces
-        face_path = KNOWN_FACES_DIR / f"{name}.jpg"
-        cv2.imwrite(str(face_path), cv2.cvtColor(face_image, cv2.COLOR_RGB2BGR))
-        
-        # Reload known faces
-        global known_encodings, known_names
-        known_encodings, known_names = load_known_faces()
+        # Save face and add it to the index
+        await asyncio.to_thread(enroll_face, name, rgb_image, face_locations[0])
         
         # Update database if this was an unknown person
         if detection_info['status'] == 'unknown':
             timestamp = detection_info['timestamp']
             # Update the detection record
-            conn = sqlite3.connect(DATABASE_PATH)
-            cursor = conn.cursor()
-            cursor.execute('''
+            detection_writer.execute('''
                 UPDATE detections 
                 SET person_name = ?, status = 'known'
                 WHERE timestamp = ? AND person_name = 'Unknown'
             ''', (name, timestamp))
-            conn.commit()
-            conn.close()
         
         # Delete pending detection
-        del pending_detections[detection_id]
+        for message_id in detection_info['message_ids']:
+            pending_detections.pop(message_id, None)
         
         await update.message.reply_text(f"✅ Wajah {name} berhasil ditambahkan ke known_faces!")
         
@@ -526,40 +3634,133 @@ def logout():
 def dashboard():
     status_filter = request.args.get('status', 'all')
     
-    if status_filter == 'known':
-        detections = get_detections(limit=200, status='known')
-    elif status_filter == 'unknown':
-        detections = get_detections(limit=200, status='unknown')
+    # First page only; the gallery loads more through /api/detections
+    if status_filter in ('known', 'unknown'):
+        detections, next_cursor = get_detections(limit=DASHBOARD_PAGE_SIZE, status=status_filter)
     else:
-        detections = get_detections(limit=200)
+        detections, next_cursor = get_detections(limit=DASHBOARD_PAGE_SIZE)
     
-    return render_template('dashboard.html', detections=detections, status_filter=status_filter)
+    return render_template('dashboard.html', detections=detections, status_filter=status_filter,
+                           next_cursor=next_cursor)
+
+def get_camera(camera_id=None):
+    """Find a camera by id, defaulting to the first configured camera"""
+    for camera in cameras:
+        if camera_id is None or camera.id == camera_id:
+            return camera
+    return None
 
 @app.route('/stream')
 @login_required
 def stream():
     """Video streaming route"""
+    camera_id = request.args.get('camera')
+    
+    # Only configured cameras get the placeholder while they connect;
+    # anything else would hold a worker forever
+    try:
+        configured = [config['id'] for config in load_camera_config()]
+    except (OSError, ValueError):
+        configured = []
+    if camera_id is None and configured:
+        camera_id = configured[0]
+    if camera_id not in configured:
+        return jsonify({'success': False, 'error': 'Unknown camera'}), 404
+    
     def generate():
-        global latest_frame
-        while True:
-            with frame_lock:
-                if latest_frame is not None:
-                    # Encode frame as JPEG
-                    ret, buffer = cv2.imencode('.jpg', latest_frame)
-                    frame = buffer.tobytes()
-                    yield (b'--frame\r\n'
-                           b'Content-Type: image/jpeg\r\n\r\n' + frame + b'\r\n')
-                else:
-                    # Send placeholder if no frame
-                    placeholder = np.zeros((480, 640, 3), dtype=np.uint8)
-                    ret, buffer = cv2.imencode('.jpg', placeholder)
-                    frame = buffer.tobytes()
-                    yield (b'--frame\r\n'
-                           b'Content-Type: image/jpeg\r\n\r\n' + frame + b'\r\n')
-            time.sleep(0.1)
+        # Cameras connect in the background; show the placeholder until then
+        camera = get_camera(camera_id)
+        while camera is None:
+            yield mjpeg_part(placeholder_jpeg())
+            time.sleep(1)
+            camera = get_camera(camera_id)
+        
+        yield from camera.broadcaster.frames()
     
     return Response(generate(), mimetype='multipart/x-mixed-replace; boundary=frame')
 
+@app.route('/api/cameras')
+@login_required
+def api_cameras():
+    """API to get list of configured cameras"""
+    return jsonify([{'id': camera.id, 'name': camera.name} for camera in cameras])
+
+def media_url(path):
+    """URL of a file under UPLOADS_DIR, or None"""
+    if not path:
+        return None
+    try:
+        return url_for('media', filename=Path(path).relative_to(UPLOADS_DIR).as_posix())
+    except ValueError:
+        return None
+
+app.jinja_env.globals['media_url'] = media_url
+
+def detection_urls(detection):
+    """Photo URLs for a detection row; thumbnails fall back to the full photos"""
+    original = media_url(detection['original_photo_path'])
+    zoom = media_url(detection['zoom_photo_path'])
+    return {
+        'original_url': original,
+        'zoom_url': zoom,
+        'thumbnail_url': media_url(detection['thumbnail_path']) or original,
+        'zoom_thumbnail_url': media_url(detection['zoom_thumbnail_path']) or zoom,
+        'clip_url': media_url(detection['clip_path']),
+    }
+
+app.jinja_env.globals['detection_urls'] = detection_urls
+
+@app.route('/media/<path:filename>')
+@login_required
+def media(filename):
+    """Serve detection photos with ETag/Last-Modified, conditional GET and ranges"""
+    response = send_from_directory(UPLOADS_DIR.resolve(), filename, conditional=True, max_age=MEDIA_MAX_AGE)
+    # Behind a login, so only the browser may cache it
+    response.cache_control.public = False
+    response.cache_control.private = True
+    if filename.startswith('thumbs/'):
+        # Content-addressed: the bytes behind a thumbnail URL never change
+        response.cache_control.max_age = 31536000
+        response.cache_control.immutable = True
+    return response
+
+@app.route('/api/detections')
+@login_required
+def api_detections():
+    """API to page through detections with optional filters"""
+    camera_name = request.args.get('camera')
+    camera = get_camera(camera_name) if camera_name else None
+    if camera:
+        # Accept a camera id as well as the stored camera name
+        camera_name = camera.name
+    
+    status = request.args.get('status')
+    if status == 'all':
+        status = None
+    
+    try:
+        limit = min(max(int(request.args.get('limit', DASHBOARD_PAGE_SIZE)), 1), 200)
+        detections, next_cursor = get_detections(
+            limit=limit,
+            status=status,
+            camera_name=camera_name,
+            person_name=request.args.get('person'),
+            since=request.args.get('since'),
+            until=request.args.get('until'),
+            cursor=request.args.get('cursor')
+        )
+    except ValueError as e:
+        return jsonify({'error': str(e)}), 400
+    
+    columns = ('id', 'timestamp', 'person_name', 'status', 'camera_name')
+    return jsonify({
+        'detections': [
+            dict({column: detection[column] for column in columns}, **detection_urls(detection))
+            for detection in detections
+        ],
+        'next_cursor': next_cursor
+    })
+
 @app.route('/api/known_faces')
 @login_required
 def api_known_faces():
@@ -569,31 +3770,179 @@ def api_known_faces():
         known_faces.append(face_path.stem)
     return jsonify(known_faces)
 
+@app.route('/api/stats')
+@login_required
+def api_stats():
+    """API to get pipeline counters"""
+    return jsonify(pipeline_stats())
+
+def pipeline_stats():
+    """Counters and latency histograms of every pipeline stage"""
+    capture = {camera.id: camera.grabber.stats() for camera in cameras}
+    tracking = {camera.id: camera.tracker.stats() for camera in cameras}
+    motion = {camera.id: camera.motion.stats() for camera in cameras}
+    streaming = {camera.id: camera.broadcaster.stats() for camera in cameras}
+    clips = {camera.id: camera.clips.stats() for camera in cameras if camera.clips}
+    persistence = detection_writer.stats()
+    retention = retention_cleaner.stats()
+    notifications = telegram_dispatcher.stats()
+    inference = {
+        'mode': INFERENCE_MODE,
+        'processes': inference_pool.stats() if isinstance(inference_pool, ProcessInferencePool) else None,
+        'batch_size': batch_size_histogram.snapshot(),
+        'batch_latency_ms': batch_latency_histogram.snapshot(),
+        'frame_handling_ms': recognition_latency_histogram.snapshot(),
+    }
+    inference['rate'] = rate_governor.stats(cameras)
+    return {'models': models.status(), 'capture': capture, 'inference': inference,
+            'tracking': tracking, 'motion': motion, 'streaming': streaming, 'clips': clips,
+            'persistence': persistence, 'retention': retention, 'notifications': notifications}
+
+def collect_metrics():
+    """Prometheus exposition of pipeline counters, latencies and process usage"""
+    metrics = MetricsWriter()
+    by_camera = [({'camera': camera.id}, camera) for camera in cameras]
+    capture = [(labels, camera.grabber.stats()) for labels, camera in by_camera]
+    
+    metrics.gauge('models_ready', 'Whether YOLO and known faces are loaded',
+                  [({}, int(models.state == 'ready'))])
+    
+    # Capture
+    metrics.counter('capture_frames_total', 'Frames decoded per camera',
+                    [(labels, stats['frames_decoded']) for labels, stats in capture])
+    metrics.counter('capture_frames_dropped_total', 'Decoded frames never processed',
+                    [(labels, stats['frames_dropped']) for labels, stats in capture])
+    metrics.counter('capture_read_failures_total', 'Failed frame reads / decodes',
+                    [(labels, stats['read_failures']) for labels, stats in capture])
+    metrics.gauge('capture_fps', 'Smoothed capture frame rate',
+                  [(labels, stats['fps']) for labels, stats in capture])
+    metrics.gauge('capture_connected', 'Whether the camera stream is connected',
+                  [(labels, int(stats['connected'])) for labels, stats in capture])
+    metrics.gauge('capture_uptime_seconds', 'Seconds since the stream last connected',
+                  [(labels, stats['uptime_s']) for labels, stats in capture])
+    metrics.gauge('capture_availability_ratio', 'Share of time the stream has been connected',
+                  [(labels, stats['availability']) for labels, stats in capture])
+    metrics.counter('capture_reconnects_total', 'Successful reconnects after a drop',
+                    [(labels, stats['reconnects']) for labels, stats in capture])
+    metrics.counter('capture_stalls_total', 'Connections dropped for delivering no frames',
+                    [(labels, stats['stalls']) for labels, stats in capture])
+    metrics.counter('capture_frame_allocations_total', 'Frame buffers allocated instead of reused',
+                    [(labels, stats['frame_pool']['allocations']) for labels, stats in capture])
+    metrics.counter('capture_frame_allocated_bytes_total', 'Bytes of frame buffers allocated',
+                    [(labels, stats['frame_pool']['allocated_bytes']) for labels, stats in capture])
+    metrics.counter('capture_frame_reuses_total', 'Frames decoded into a reused pool buffer',
+                    [(labels, stats['frame_pool']['reuses']) for labels, stats in capture])
+    metrics.gauge('capture_frame_buffers_in_use', 'Pooled frame buffers still referenced',
+                  [(labels, stats['frame_pool']['in_use']) for labels, stats in capture])
+    
+    # Inference
+    metrics.counter('motion_frames_skipped_total', 'Frames skipped by the motion gate',
+                    [(labels, camera.motion.frames_skipped) for labels, camera in by_camera])
+    metrics.histogram('yolo_batch_seconds', 'YOLO latency per batched call',
+                      [({}, batch_latency_histogram)], scale=0.001)
+    metrics.histogram('yolo_batch_size', 'Frames per batched YOLO call', [({}, batch_size_histogram)])
+    metrics.histogram('face_recognition_seconds', 'Tracking and face recognition time per frame',
+                      [({}, face_stage_histogram)], scale=0.001)
+    metrics.histogram('frame_handling_seconds', 'Time from YOLO result to queued alert per frame',
+                      [({}, recognition_latency_histogram)], scale=0.001)
+    metrics.histogram('persons_per_frame', 'Person detections per processed frame',
+                      [({}, persons_per_frame_histogram)])
+    metrics.counter('face_recognition_attempts_total', 'Face searches run on person boxes',
+                    [({}, face_attempts_counter.value)])
+    metrics.counter('face_recognition_matches_total', 'Faces matched to a known person',
+                    [({}, face_matches_counter.value)])
+    attempts = face_attempts_counter.value
+    metrics.gauge('face_recognition_hit_rate', 'Share of face searches that matched a known person',
+                  [({}, round(face_matches_counter.value / attempts, 4) if attempts else None)])
+    metrics.gauge('tracks_active', 'Person tracks currently alive',
+                  [(labels, len(camera.tracker.tracks)) for labels, camera in by_camera])
+    rate = rate_governor.stats(cameras)
+    metrics.gauge('analysis_target_fps', 'Analysis rate set by the rate governor',
+                  [(labels, rate['cameras'][camera.id]['target_fps']) for labels, camera in by_camera])
+    metrics.gauge('analysis_fps', 'Frames actually analysed per second',
+                  [(labels, rate['cameras'][camera.id]['effective_fps']) for labels, camera in by_camera])
+    metrics.gauge('governor_load_factor', 'Share of the wanted analysis rate currently allowed',
+                  [({}, rate['load_factor'])])
+    metrics.gauge('governor_latency_seconds', 'Smoothed capture-to-handled latency per frame',
+                  [({}, rate['latency_ms'] / 1000 if rate['latency_ms'] is not None else None)])
+    metrics.gauge('governor_cpu_percent', 'Pipeline CPU use in percent of all cores',
+                  [({}, rate['cpu_percent'])])
+    metrics.counter('governor_throttles_total', 'Times the analysis rate was cut',
+                    [({}, rate['throttles'])])
+    
+    # Persistence
+    persistence = detection_writer.stats()
+    metrics.histogram('db_commit_seconds', 'Detection writer commit latency',
+                      [({}, detection_writer.commit_latency)], scale=0.001)
+    metrics.counter('db_rows_written_total', 'Statements committed by the detection writer',
+                    [({}, persistence['rows_written'])])
+    metrics.counter('db_write_errors_total', 'Failed image writes and commits',
+                    [({}, persistence['write_errors'])])
+    metrics.gauge('db_queue_depth', 'Statements waiting for the detection writer',
+                  [({}, persistence['queue_depth'])])
+    metrics.counter('retention_rows_deleted_total', 'Detections removed by retention cleanup',
+                    [({}, retention_cleaner.rows_deleted)])
+    
+    # Notifications
+    notifications = telegram_dispatcher.stats()
+    metrics.histogram('telegram_send_seconds', 'Telegram alert send latency',
+                      [({}, telegram_dispatcher.send_latency)], scale=0.001)
+    metrics.counter('telegram_sent_total', 'Alerts sent to Telegram', [({}, notifications['sent'])])
+    metrics.counter('telegram_errors_total', 'Alerts that failed to send', [({}, notifications['errors'])])
+    metrics.counter('telegram_dropped_total', 'Alerts dropped from a full backlog',
+                    [({}, notifications['dropped'])])
+    metrics.gauge('telegram_backlog', 'Alerts waiting to be sent', [({}, notifications['backlog'])])
+    
+    # Streaming
+    metrics.gauge('stream_clients', 'Connected /stream viewers',
+                  [(labels, camera.broadcaster.clients) for labels, camera in by_camera])
+    metrics.counter('stream_frames_encoded_total', 'JPEG frames encoded for /stream',
+                    [(labels, camera.broadcaster.frames_encoded) for labels, camera in by_camera])
+    
+    # Clips
+    recorders = [(labels, camera.clips) for labels, camera in by_camera if camera.clips]
+    metrics.gauge('clip_buffer_bytes', 'Memory held by the pre-event clip buffer',
+                  [(labels, recorder.buffer_bytes) for labels, recorder in recorders])
+    metrics.counter('clips_written_total', 'Event clips written',
+                    [(labels, recorder.clips_written) for labels, recorder in recorders])
+    metrics.counter('clip_errors_total', 'Event clips that failed to write',
+                    [(labels, recorder.clip_errors) for labels, recorder in recorders])
+    
+    # Process
+    rss, os_threads = process_resource_usage()
+    metrics.gauge('process_resident_memory_bytes', 'Resident set size', [({}, rss)])
+    metrics.gauge('process_threads', 'OS threads in the process', [({}, os_threads)])
+    metrics.gauge('python_threads', 'Live Python threads', [({}, threading.active_count())])
+    metrics.gauge('process_uptime_seconds', 'Seconds since start',
+                  [({}, round(time.perf_counter() - PROCESS_START_TIME, 1))])
+    return metrics.render()
+
+@app.route('/metrics')
+def metrics_endpoint():
+    """Prometheus scrape target; needs METRICS_TOKEN as a bearer token, or a logged-in session"""
+    authorization = request.headers.get('Authorization', '')
+    token_ok = METRICS_TOKEN and authorization == f'Bearer {METRICS_TOKEN}'
+    if not token_ok and not current_user.is_authenticated:
+        return Response('Unauthorized\n', status=401, mimetype='text/plain')
+    return Response(collect_metrics(), mimetype='text/plain; version=0.0.4')
+
 @app.route('/api/delete_detection/<int:detection_id>', methods=['DELETE'])
 @login_required
 def delete_detection(detection_id):
     """Delete a specific detection"""
-    conn = sqlite3.connect(DATABASE_PATH)
+    conn = get_db_connection()
     cursor = conn.cursor()
     
-    cursor.execute('SELECT original_photo_path, zoom_photo_path FROM detections WHERE id = ?', (detection_id,))
+    cursor.execute(f"SELECT {', '.join(MEDIA_COLUMNS)} FROM detections WHERE id = ?", (detection_id,))
     detection = cursor.fetchone()
     
     if detection:
-        original_path, zoom_path = detection
-        
-        # Delete files
-        try:
-            if original_path and os.path.exists(original_path):
-                os.remove(original_path)
-            if zoom_path and os.path.exists(zoom_path):
-                os.remove(zoom_path)
-        except Exception as e:
-            print(f"Error deleting files: {e}")
-        
         # Delete from database
         cursor.execute('DELETE FROM detections WHERE id = ?', (detection_id,))
         conn.commit()
+        
+        # Delete files no other detection shares
+        remove_files(unreferenced_files(conn, detection))
         conn.close()
         return jsonify({'success': True})
     
@@ -601,129 +3950,168 @@ def delete_detection(detection_id):
     return jsonify({'success': False}), 404
 
 # ============== MAIN DETECTION LOOP ==============
-def detection_loop():
-    """Main AI detection loop"""
-    global latest_frame, known_encodings, known_names
-    
-    print("[AI] Starting detection loop...")
+def handle_frame(camera, frame, detections, faces=None):
+    """Recognize persons in one camera frame and record/notify new ones"""
+    # Recognize faces of detected persons
+    persons = recognize_persons(frame, detections, camera.tracker, faces)
+    current_time = time.time()
     
-    cap = cv2.VideoCapture(RTSP_URL)
+    alerts = []
+    for person in persons:
+        track = person['track']
+        
+        # Ignore tracks that have not been confirmed over several frames yet
+        if track.hits < TRACK_MIN_HITS:
+            continue
+        
+        # One alert per track (optionally repeated for people who linger)
+        if track.alerted_at is not None:
+            if not ALERT_REPEAT_AFTER or current_time - track.alerted_at < ALERT_REPEAT_AFTER:
+                continue
+        
+        alerts.append(person)
     
-    if not cap.isOpened():
-        print(f"[Error] Cannot connect to RTSP stream: {RTSP_URL}")
+    if not alerts:
         return
     
-    frame_count = 0
-    last_notification_time = {}
+    # One copy of the shared frame per alerting frame, with every alerted
+    # person drawn; it is only read once the saves have been queued
+    annotated_frame = annotated_snapshot(frame, alerts)
     
-    while True:
-        ret, frame = cap.read()
+    for person in alerts:
+        person_name = person['person_name']
+        status = person['status']
+        track = person['track']
         
-        if not ret:
-            print("[Error] Failed to read frame")
-            time.sleep(1)
-            continue
+        # Save photos
+        timestamp_str = datetime.now().isoformat()
+        timestamp_id = int(current_time * 1000)
         
-        # Update latest frame for web streaming
-        with frame_lock:
-            latest_frame = frame.copy()
+        # Several people can alert from the same frame; the track keeps their files apart
+        original_path = UPLOADS_DIR / f"det_{timestamp_id}_{camera.id}_{track.id}_original.jpg"
+        zoomed_path = UPLOADS_DIR / f"det_{timestamp_id}_{camera.id}_{track.id}_zoom.jpg"
         
-        # Process every Nth frame
-        frame_count += 1
-        if frame_count % FRAME_PROCESS_INTERVAL != 0:
-            continue
+        # Create zoomed frame from the full-resolution frame and draw on the crop
+        zoomed_frame, zoom_scale, zoom_offset = zoom_frame(frame, person['bbox'], ZOOM_FACTOR)
+        draw_person(zoomed_frame, person, zoom_scale, zoom_offset)
         
-        # Detect persons
-        persons = process_frame(frame)
+        # Send Telegram notification with the JPEGs encoded for the files
+        def notify(jpegs, person_name=person_name, status=status,
+                   timestamp_str=timestamp_str, zoomed_path=zoomed_path):
+            send_detection_notification(
+                jpegs[0],
+                jpegs[1],
+                person_name,
+                status,
+                timestamp_str,
+                camera.name,
+                str(zoomed_path)
+            )
         
-        if persons:
-            for person in persons:
-                person_name = person['person_name']
-                status = person['status']
-                
-                # Generate unique ID for this person (based on bbox position)
-                bbox_id = f"{int(person['bbox'][0]/50)}_{int(person['bbox'][1]/50)}"
-                
-                # Check cooldown for notifications (avoid spam)
-                current_time = time.time()
-                if bbox_id in last_notification_time:
-                    if current_time - last_notification_time[bbox_id] < 30:  # 30 seconds cooldown
-                        continue
-                
-                # Save photos
-                timestamp_str = datetime.now().isoformat()
-                timestamp_id = int(time.time())
-                
-                original_path = UPLOADS_DIR / f"det_{timestamp_id}_original.jpg"
-                zoomed_path = UPLOADS_DIR / f"det_{timestamp_id}_zoom.jpg"
-                
-                # Draw bounding box on original
-                annotated_frame = frame.copy()
-                x1, y1, x2, y2 = person['bbox']
-                color = (0, 255, 0) if status == 'known' else (0, 0, 255)
-                cv2.rectangle(annotated_frame, (x1, y1), (x2, y2), color, 2)
-                label = f"{person_name} ({person['confidence']:.2f})"
-                cv2.putText(annotated_frame, label, (x1, y1-10), 
-                           cv2.FONT_HERSHEY_SIMPLEX, 0.5, color, 2)
-                
-                # Create zoomed frame
-                zoomed_frame = zoom_frame(annotated_frame, person['bbox'], ZOOM_FACTOR)
-                
-                # Save files
-                cv2.imwrite(str(original_path), annotated_frame)
-                cv2.imwrite(str(zoomed_frame), zoomed_frame)
-                
-                # Save to database
-                save_detection(
-                    timestamp_str,
-                    person_name,
-                    status,
-                    str(original_path),
-                    str(zoomed_path),
-                    CAMERA_NAME
-                )
-                
-                # Send Telegram notification
-                send_detection_notification(
-                    annotated_frame,
-                    zoomed_frame,
-                    person_name,
-                    status,
-                    timestamp_str
-                )
-                
-                # Update last notification time
-                last_notification_time[bbox_id] = current_time
+        # Save files and database row in the background
+        save_detection(
+            timestamp_str,
+            person_name,
+            status,
+            str(original_path),
+            str(zoomed_path),
+            camera.name,
+            images=[(original_path, annotated_frame), (zoomed_path, zoomed_frame)],
+            on_written=notify
+        )
+        
+        # Linked to the row once the clip has been written
+        if camera.clips:
+            camera.clips.trigger(timestamp_str)
+        
+        track.alerted_at = current_time
+
+def detection_loop():
+    """Main AI detection loop"""
+    global cameras
+    
+    print("[AI] Starting detection loop...")
+    
+    scheduler = InferenceScheduler([])
+    
+    for config in load_camera_config():
+        camera = CameraStream(config, on_frame=scheduler.notify)
         
-        time.sleep(0.01)
+        # Cameras connect in parallel; unreachable ones keep being retried
+        camera.grabber.start()
+        if camera.clips:
+            camera.clips.start()
+        cameras.append(camera)
+    
+    if not cameras:
+        print("[Error] No camera configured, detection stopped")
+        return
+    
+    # Wait for the background warm-up (or load now if it was not started)
+    try:
+        models.load()
+    except Exception:
+        print("[Error] AI models unavailable, detection stopped")
+        return
+    
+    scheduler.cameras = cameras
+    
+    global inference_pool
+    inference_pool = start_inference(scheduler, handle_frame)
+    print(f"[AI] Inference running in {INFERENCE_MODE} mode")
+    
+    for thread in inference_pool.threads:
+        thread.join()
 
 # ============== CLEANUP TASK ==============
+def stop_cameras():
+    """Stop capture and finish the clips being recorded.
+    
+    Must run before interpreter shutdown, which closes clip_pool to new
+    work; the detection writer (stopped at exit) then links the clips.
+    """
+    for camera in cameras:
+        if camera.clips:
+            camera.clips.stop()
+        camera.grabber.stop()
+    clip_pool.shutdown(wait=True)
+
 def cleanup_task():
     """Periodic cleanup of old detections"""
     while True:
-        delete_old_detections()
+        retention_cleaner.run()
         time.sleep(CLEANUP_CHECK_INTERVAL)
 
 # ============== MAIN ==============
 if __name__ == '__main__':
+    # Turn SIGTERM (systemd stop) into a normal exit so pending rows are flushed
+    signal.signal(signal.SIGTERM, lambda signum, frame: sys.exit(0))
+    
+    # Start loading AI models while everything else comes up
+    models.start_background()
+    
     # Initialize database
     init_database()
     
     # Start Telegram bot
-    global bot
-    bot_app = Application.builder().token(TELEGRAM_BOT_TOKEN).build()
-    bot = bot_app.bot
-    
-    # Add handlers
-    bot_app.add_handler(MessageHandler(filters.PHOTO, handle_photo))
-    bot_app.add_handler(MessageHandler(filters.TEXT & ~filters.COMMAND, handle_message))
-    
-    # Start bot in thread with asyncio
-    def run_bot():
-        asyncio.run(bot_app.run_polling())
-    
-    bot_thread = threading.Thread(target=run_bot, daemon=True)
-    bot_thread.start()
+    if TELEGRAM_BOT_TOKEN:
+        async def on_bot_start(application):
+            # Alerts from detection threads are sent on this loop
+            telegram_dispatcher.attach(application.bot, asyncio.get_running_loop())
+        
+        bot_app = Application.builder().token(TELEGRAM_BOT_TOKEN).post_init(on_bot_start).build()
+        
+        # Add handlers
+        bot_app.add_handler(MessageHandler(filters.PHOTO, handle_photo))
+        bot_app.add_handler(MessageHandler(filters.TEXT & ~filters.COMMAND, handle_message))
+        
+        # Start bot in thread with its own asyncio loop; signals belong to the main thread
+        def run_bot():
+            asyncio.set_event_loop(asyncio.new_event_loop())
+            bot_app.run_polling(stop_signals=None)
+        
+        bot_thread = threading.Thread(target=run_bot, daemon=True)
+        bot_thread.start()
     
     # Start cleanup task
     cleanup_thread = threading.Thread(target=cleanup_task, daemon=True)
@@ -734,5 +4122,9 @@ if __name__ == '__main__':
     detection_thread.start()
     
     # Start Flask web server
+    print(f"[Startup] Web server ready after {time.perf_counter() - PROCESS_START_TIME:.2f}s")
     print(f"[Web] Starting web server on {WEB_HOST}:{WEB_PORT}")
-    app.run(host=WEB_HOST, port=WEB_PORT, debug=False, threaded=True)
+    try:
+        app.run(host=WEB_HOST, port=WEB_PORT, debug=False, threaded=True)
+    finally:
+        stop_cameras()
@@ -0,0 +1,242 @@
+#!/usr/bin/env python3
+"""
+Camera Simulator Script
+Run the capture, inference and alerting stages against K virtual cameras on
+one machine, with optional stalls and disconnects injected into each stream,
+and print the pipeline counters as JSON.
+
+Cameras use synthetic frames unless --source points at a video file or a
+directory of images. Detections go to a temporary database and Telegram is
+disabled, so nothing outside the process is touched:
+
+    python3 simulate_cameras.py --cameras 8 --fps 15 --duration 120 \\
+        --disconnect-every 60 --disconnect-duration 5
+
+Run it once per INFERENCE_MODE to compare threaded and process inference:
+
+    INFERENCE_MODE=process python3 simulate_cameras.py --cameras 8 --duration 120
+"""
+
+import argparse
+import contextlib
+import json
+import math
+import os
+import random
+import resource
+import sys
+import tempfile
+import time
+from pathlib import Path
+
+# Must be set before main.py reads its configuration
+os.environ['TELEGRAM_BOT_TOKEN'] = ''
+
+import main
+
+
+class FaultInjectingSource(main.FrameSource):
+    """Wrap a frame source and inject stalls and disconnects.
+
+    A stall makes one read hang for stall_duration seconds before returning
+    a frame. A disconnect makes every read fail (and reopening fail) for
+    disconnect_duration seconds. Events are spaced by exponential random
+    intervals around the given means; a mean of 0 disables the event.
+    """
+
+    def __init__(self, source, stall_every=0, stall_duration=0, disconnect_every=0,
+                 disconnect_duration=0, seed=None):
+        self.source = source
+        self.stall_every = stall_every
+        self.stall_duration = stall_duration
+        self.disconnect_every = disconnect_every
+        self.disconnect_duration = disconnect_duration
+        self.random = random.Random(seed)
+        self.stalls = 0
+        self.disconnects = 0
+        self.down_until = 0
+        now = time.monotonic()
+        self.next_stall = now + self._interval(stall_every)
+        self.next_disconnect = now + self._interval(disconnect_every)
+
+    def _interval(self, mean):
+        return self.random.expovariate(1 / mean) if mean > 0 else math.inf
+
+    def open(self):
+        if time.monotonic() < self.down_until:
+            return False
+        return self.source.open()
+
+    def read(self, frame=None):
+        now = time.monotonic()
+
+        if now < self.down_until:
+            # A dead stream does not answer immediately either
+            time.sleep(0.1)
+            return False, None
+
+        if now >= self.next_disconnect:
+            self.disconnects += 1
+            self.down_until = now + self.disconnect_duration
+            self.next_disconnect = self.down_until + self._interval(self.disconnect_every)
+            return False, None
+
+        if now >= self.next_stall:
+            self.stalls += 1
+            time.sleep(self.stall_duration)
+            self.next_stall = time.monotonic() + self._interval(self.stall_every)
+
+        return self.source.read(frame)
+
+    def release(self):
+        self.source.release()
+
+
+@contextlib.contextmanager
+def stdout_to_stderr():
+    """Send stdout to stderr, including that of inference processes"""
+    sys.stdout.flush()
+    saved = os.dup(1)
+    os.dup2(2, 1)
+    try:
+        with contextlib.redirect_stdout(sys.stderr):
+            yield
+    finally:
+        sys.stdout.flush()
+        os.dup2(saved, 1)
+        os.close(saved)
+
+
+def camera_url(args, index):
+    if args.source:
+        return f"{args.source}?fps={args.fps}" if args.fps else args.source
+    return f"synthetic://?width={args.width}&height={args.height}&fps={args.fps or 15}&seed={index}"
+
+
+def run_simulation(args):
+    work_dir = Path(tempfile.mkdtemp(prefix='riftech-sim-'))
+    main.DATABASE_PATH = str(work_dir / 'detections.db')
+    main.UPLOADS_DIR = work_dir / 'uploads'
+    main.THUMBNAILS_DIR = main.UPLOADS_DIR / 'thumbs'
+    main.THUMBNAILS_DIR.mkdir(parents=True)
+    main.CLIPS_DIR = main.UPLOADS_DIR / 'clips'
+    main.CLIPS_DIR.mkdir()
+    main.init_database()
+
+    main.models.load()
+    if main.models.state != 'ready':
+        raise RuntimeError(f"Models failed to load: {main.models.error}")
+
+    scheduler = main.InferenceScheduler([])
+    sources = {}
+
+    for index in range(args.cameras):
+        config = {'id': f'sim{index}', 'name': f'Simulated {index}', 'url': camera_url(args, index)}
+        source = FaultInjectingSource(
+            main.open_frame_source(config['url']),
+            args.stall_every, args.stall_duration,
+            args.disconnect_every, args.disconnect_duration,
+            seed=args.seed + index
+        )
+        camera = main.CameraStream(config, on_frame=scheduler.notify, source=source)
+        camera.grabber.start()
+        if camera.clips:
+            camera.clips.start()
+        main.cameras.append(camera)
+        sources[camera.id] = source
+
+    scheduler.cameras = main.cameras
+
+    cpu_start = os.times()
+    children_start = resource.getrusage(resource.RUSAGE_CHILDREN)
+    wall_start = time.perf_counter()
+    main.inference_pool = main.start_inference(scheduler, main.handle_frame)
+
+    deadline = time.monotonic() + args.duration
+    while time.monotonic() < deadline:
+        time.sleep(min(10, max(0, deadline - time.monotonic())))
+        print(f"[Simulator] {time.perf_counter() - wall_start:.0f}s, "
+              f"{main.recognition_latency_histogram.count} frames processed")
+
+    main.stop_cameras()
+    stats = main.pipeline_stats()
+    if isinstance(main.inference_pool, main.ProcessInferencePool):
+        main.inference_pool.stop()
+    main.detection_writer.stop()
+
+    wall_seconds = time.perf_counter() - wall_start
+    cpu_end = os.times()
+    children_end = resource.getrusage(resource.RUSAGE_CHILDREN)
+    # Inference processes count once they have been joined
+    cpu_seconds = ((cpu_end.user - cpu_start.user) + (cpu_end.system - cpu_start.system)
+                   + (children_end.ru_utime - children_start.ru_utime)
+                   + (children_end.ru_stime - children_start.ru_stime))
+    decoded = sum(capture['frames_decoded'] for capture in stats['capture'].values())
+    processed = main.recognition_latency_histogram.count
+
+    return {
+        'cameras': args.cameras,
+        'source': args.source or 'synthetic',
+        'resolution': None if args.source else f"{args.width}x{args.height}",
+        'camera_fps': args.fps,
+        'config': {
+            'INFERENCE_MODE': main.INFERENCE_MODE,
+            'INFERENCE_PROCESSES': main.inference_pool.process_count
+            if main.INFERENCE_MODE == 'process' else None,
+            'INFERENCE_WORKERS': main.INFERENCE_WORKERS,
+            'YOLO_BATCH_SIZE': main.YOLO_BATCH_SIZE,
+            'ANALYSIS_ACTIVE_FPS': main.ANALYSIS_ACTIVE_FPS,
+            'ANALYSIS_IDLE_FPS': main.ANALYSIS_IDLE_FPS,
+            'TARGET_LATENCY_MS': main.TARGET_LATENCY_MS,
+            'CPU_BUDGET': main.CPU_BUDGET,
+            'FRAME_RESIZE_WIDTH': main.FRAME_RESIZE_WIDTH,
+            'MOTION_GATING': main.MOTION_GATING,
+        },
+        'wall_seconds': round(wall_seconds, 3),
+        'fps': {
+            'decoded': round(decoded / wall_seconds, 2),
+            'processed': round(processed / wall_seconds, 2),
+        },
+        'faults': {camera_id: {'stalls': source.stalls, 'disconnects': source.disconnects}
+                   for camera_id, source in sources.items()},
+        'peak_rss_mb': round(resource.getrusage(resource.RUSAGE_SELF).ru_maxrss / 1024, 1),
+        'cpu': {
+            'seconds': round(cpu_seconds, 3),
+            'cores_used': round(cpu_seconds / wall_seconds, 3),
+            'utilization_pct': round(100 * cpu_seconds / wall_seconds / (os.cpu_count() or 1), 1),
+        },
+        'pipeline': stats,
+        'work_dir': str(work_dir),
+    }
+
+
+def parse_args(argv=None):
+    parser = argparse.ArgumentParser(description="Load-test the pipeline with virtual cameras")
+    parser.add_argument('--cameras', type=int, default=4, help="Number of virtual cameras")
+    parser.add_argument('--source', help="Video file or image directory replayed by every camera")
+    parser.add_argument('--width', type=int, default=1280, help="Synthetic frame width")
+    parser.add_argument('--height', type=int, default=720, help="Synthetic frame height")
+    parser.add_argument('--fps', type=float, default=0, help="Camera frame rate (default 15, or the file's)")
+    parser.add_argument('--duration', type=float, default=60, help="Seconds to run")
+    parser.add_argument('--stall-every', type=float, default=0, help="Mean seconds between stalls per camera")
+    parser.add_argument('--stall-duration', type=float, default=3, help="Seconds a stalled read hangs")
+    parser.add_argument('--disconnect-every', type=float, default=0,
+                        help="Mean seconds between disconnects per camera")
+    parser.add_argument('--disconnect-duration', type=float, default=10, help="Seconds a camera stays down")
+    parser.add_argument('--seed', type=int, default=0, help="Seed for fault timing and synthetic frames")
+    parser.add_argument('--output', help="Also write the JSON report to this file")
+    return parser.parse_args(argv)
+
+
+if __name__ == "__main__":
+    args = parse_args()
+
+    # Keep stdout for the report; pipeline log lines go to stderr
+    with stdout_to_stderr():
+        report = run_simulation(args)
+
+    text = json.dumps(report, indent=2)
+    print(text)
+    if args.output:
+        with open(args.output, 'w') as f:
+            f.write(text + '\n')